@@ -0,0 +1,38 @@
+# Author: Renzo Mischianti
+# Website: www.mischianti.org
+#
+# Description:
+# This script demonstrates how to use the E22 LoRa module with asyncio.
+# It sends a dictionary to a fixed address and then prints the messages received,
+# while the event loop stays free for other tasks.
+# ADDH = 0x00
+# ADDL = 0x01
+# CHAN = 23
+#
+# Note: This code was written and tested using RaspberryPi on an ESP32 board.
+#       It works with other boards, but you may need to change the UART pins.
+
+import asyncio
+import serial
+
+from lora_e22_async import AsyncLoRaE22
+from lora_e22_operation_constant import ResponseStatusCode
+
+
+async def main():
+    loraSerial = serial.Serial('/dev/serial0')
+    lora = AsyncLoRaE22('400T22D', loraSerial, aux_pin=18, m0_pin=23, m1_pin=24)
+    code = await lora.begin()
+    print("Initialization: {}", ResponseStatusCode.get_description(code))
+
+    # Send a dictionary message (fixed)
+    code = await lora.send_fixed_dict(0, 0x01, 23, {'key1': 'value1', 'key2': 'value2'})
+    print("Send message: {}", ResponseStatusCode.get_description(code))
+
+    print("Waiting for messages...")
+    while True:
+        code, value = await lora.receive_message(timeout=10000)
+        print(ResponseStatusCode.get_description(code))
+        print(value)
+
+asyncio.run(main())
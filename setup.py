@@ -5,7 +5,11 @@ from setuptools import setup
 setup(
     name="ebyte-lora-e22-rpi",
     package_dir={'': 'src'},
-    py_modules=["lora_e22", "lora_e22_constants", "lora_e22_operation_constant"],
+    py_modules=["lora_e22", "lora_e22_constants", "lora_e22_operation_constant", "lora_e22_async",
+                "lora_e22_receiver", "lora_e22_fragment",
+                "lora_e22_codec", "lora_e22_scheduler", "lora_e22_reliable",
+                "lora_e22_coalesce", "lora_e22_rpc", "lora_e22_tdma",
+                "lora_e22_rssi"],
     version="0.0.4",
     description="RaspberryPi LoRa EBYTE E22 device library complete and tested. sx1262/sx1268",
     long_description="RaspberryPi Ebyte E22 LoRa (Long Range) library device very cheap and very long range (from 4Km to 10Km). LoRa EBYTE E22 device library complete and tested. sx1262/sx1268",
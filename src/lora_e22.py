@@ -61,15 +61,22 @@
 from lora_e22_constants import UARTParity, UARTBaudRate, TransmissionPower, FixedTransmission, AirDataRate, \
     OperatingFrequency, LbtEnableByte, WorPeriod, RssiEnableByte, RssiAmbientNoiseEnable, SubPacketSetting
 from lora_e22_operation_constant import ResponseStatusCode, SerialUARTBaudRate, \
-    PacketLength, RegisterAddress
+    PacketLength, RegisterAddress, RssiCommand, RssiAddress
 
+import copy
+import random
 import re
+import struct
 import time
-import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future
 from RPi import GPIO
 
 from lora_e22_constants import WorTransceiverControl, RepeaterModeEnableByte
 from lora_e22_operation_constant import ModeType, ProgramCommand
+from lora_e22_codec import JsonCodec, SchemaRegistry, DeflateCompressor
 
 
 class Logger:
@@ -100,6 +107,47 @@ logger = logging.getLogger(__name__)
 
 BROADCAST_ADDRESS = 0xFF
 
+# Used only when the AUX edge detection is not available
+AUX_POLL_INTERVAL = 0.001
+# While a receive waits the first bytes of a frame the serial port is polled without the lock
+# of the driver, so the other threads can send meanwhile
+RX_POLL_INTERVAL = 0.002
+
+# Estimate of the bytes that every packet adds on air (preamble, header and CRC)
+AIR_PACKET_OVERHEAD = 8
+
+# Size of the transmit buffer of the module, used by the pipelined send
+MODULE_BUFFER_SIZE = 1000
+
+# Listen before talk: channel busy above this ambient noise (dBm), attempts before
+# ERR_E22_CHANNEL_BUSY, and bytes on air of the first backoff slot (doubled at every attempt)
+LBT_THRESHOLD = -90
+LBT_MAX_ATTEMPTS = 8
+LBT_BACKOFF_SLOT_BYTES = 32
+# Timeout (ms) of the answer of the RSSI read
+RSSI_READ_TIMEOUT = 100
+
+# Timeout (ms) of the answer of a register write in program mode
+PROGRAM_RESPONSE_TIMEOUT = 1000
+# Unchanged registers between two changed ones are written again when they cost less than a new command
+REGISTER_WRITE_HEADER_SIZE = 3
+
+# Mode switch: time (ms) for the module to pull AUX low after the M0/M1 change, and to be ready
+# after AUX goes high again
+MODE_SWITCH_AUX_DELAY = 2
+MODE_SWITCH_SETTLE_TIME = 2
+# Without AUX, time (ms) waited after a mode switch: between normal and WOR the module only
+# changes the radio mode, entering or leaving program and sleep mode it reloads its parameters
+MODE_SWITCH_TIME_NO_AUX = 40
+MODE_SWITCH_RESET_TIME_NO_AUX = 200
+MODE_SWITCH_TIMEOUT = 1000
+
+# Silence, in characters at the UART speed, that closes a received frame
+FRAME_GAP_CHARS = 4
+# Without AUX the receiving module can pause its UART output while decoding,
+# this is the pause allowed, in bytes at the air data rate
+FRAME_GAP_AIR_BYTES = 2
+
 
 class Speed:
     def __init__(self, model):
@@ -212,6 +260,13 @@ class Configuration:
     def get_frequency(self):
         return OperatingFrequency.get_freq_from_channel(self.frequency, self.CHAN)
 
+    # Estimated time on air (ms) of a payload, the module splits it in sub packets
+    def get_air_time(self, payload_size):
+        sub_packet_size = SubPacketSetting.get_size(self.OPTION.subPacketSetting)
+        packets = max(1, -(-payload_size // sub_packet_size))
+        bits = (payload_size + packets * AIR_PACKET_OVERHEAD) * 8
+        return bits * 1000 / AirDataRate.get_bps(self.SPED.airDataRate)
+
     def get_model(self):
         return self.model
 
@@ -359,10 +414,92 @@ class ModuleInformation:
         self.from_hex_array([x for x in bytes])
 
 
+class FrameParser:
+    # Splits the received byte stream in messages, the bytes after a message are kept for the next one.
+    # Every pop_* returns None if the buffer doesn't contain a complete message yet.
+    def __init__(self):
+        self.buffer = bytearray()
+        self._scan_delimiter = None
+        self._scan_start = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def feed(self, data):
+        self.buffer += data
+
+    def clear(self):
+        self.buffer.clear()
+        self._scan_start = 0
+
+    def _pop(self, size, skip=0) -> bytes:
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size + skip]
+        self._scan_start = 0
+        return data
+
+    def pop_size(self, size) -> (bytes, None) or None:
+        if len(self.buffer) < size:
+            return None
+        return self._pop(size), None
+
+    def pop_delimited(self, delimiter, rssi=False) -> (bytes, int or None) or None:
+        start = self._scan_start if self._scan_delimiter == delimiter else 0
+        index = self.buffer.find(delimiter, start)
+        if index < 0:
+            # Only the new bytes must be scanned, the delimiter can be split between two reads
+            self._scan_delimiter = delimiter
+            self._scan_start = max(0, len(self.buffer) - len(delimiter) + 1)
+            return None
+
+        end = index + len(delimiter)
+        if rssi:
+            if len(self.buffer) <= end:
+                return None
+            rssi_value = self.buffer[end]  # rssi follows the delimiter
+            return self._pop(index, len(delimiter) + 1), rssi_value
+
+        return self._pop(index, len(delimiter)), None
+
+    def pop_length_prefixed(self, rssi=False) -> (bytes, int or None) or None:
+        if len(self.buffer) == 0:
+            return None
+
+        size = self.buffer[0]
+        end = 1 + size + (1 if rssi else 0)
+        if len(self.buffer) < end:
+            return None
+
+        rssi_value = self.buffer[end - 1] if rssi else None
+        del self.buffer[:1]
+        return self._pop(size, end - 1 - size), rssi_value
+
+    # Removes the first sequence of size bytes that starts with head at or after start,
+    # the bytes around it are kept
+    def pop_sequence(self, head, size, start=0) -> (bytes, None) or None:
+        index = self.buffer.find(head, start)
+        if index < 0 or len(self.buffer) < index + size:
+            return None
+
+        data = bytes(self.buffer[index:index + size])
+        del self.buffer[index:index + size]
+        self._scan_start = 0
+        return data, None
+
+    def pop_all(self, rssi=False) -> (bytes, int or None) or None:
+        if len(self.buffer) == 0:
+            return None
+
+        data = self._pop(len(self.buffer))
+        if rssi:
+            return data[:-1], data[-1]  # last byte is rssi
+        return data, None
+
+
 class LoRaE22:
     # now the constructor that receive directly the UART object
     def __init__(self, model, uart, aux_pin=None, m0_pin=None, m1_pin=None,
-                 gpio_mode=GPIO.BCM):
+                 gpio_mode=GPIO.BCM, length_prefix=False, codec=None):
         self.uart = uart
         self.model = model
 
@@ -382,8 +519,70 @@ class LoRaE22:
 
         self.gpio_mode = gpio_mode
         self.mode = None
+        # Mode of the M0 and M1 pins, None if not driven yet
+        self._pin_mode = None
+
+        # Last configuration read from or written to the module, get_configuration returns a copy
+        # of it while it's valid, it's invalidated by a failed exchange or mode change
+        self.configuration = None
+        self._configuration_valid = False
+        # A configuration written with permanent_configuration=False is not saved
+        self._configuration_saved = True
+        # Mode to restore at the end of the program sessions, and the sessions open
+        self._program_return_mode = None
+        self._program_depth = 0
+        # Set by the channel switches that stay in program mode
+        self._program_stay = False
+
+        # Received bytes not yet returned by a receive_* call
+        self._parser = FrameParser()
+        # Sender and receiver must agree: every message starts with one byte of length,
+        # so the messages that arrive back to back can be split
+        self.length_prefix = length_prefix
+
+        # Used by send_*_dict and receive_dict, JSON if not specified
+        self.codec = codec if codec is not None else JsonCodec()
+        self.schemas = SchemaRegistry()
+        # Compresses the sent payloads when enabled, the received ones are always decompressed
+        self.compressor = None
+        self._decompressor = DeflateCompressor()
+
+        # With the pipelined send the frames are written while the module is still transmitting,
+        # (estimated end on air, size) of the frames that can be still in the module buffer
+        self.pipelined = False
+        self.buffer_size = MODULE_BUFFER_SIZE
+        self._tx_frames = deque()
+        # Listen before talk, disabled with None
+        self.lbt_threshold = None
+        self.lbt_max_attempts = LBT_MAX_ATTEMPTS
+        # When set (RssiSampler) the noise is read from its cache
+        self.rssi_sampler = None
+        # Runs the send_*_async calls one after the other, created on the first call
+        self._executor = None
+
+        # Held by every exchange on the UART (sends, RSSI reads, program mode),
+        # so the exchanges of different threads don't interleave
+        self._lock = threading.RLock()
+        # Held while reading the UART (receives, RSSI reads, program mode), also by the LoRaE22Receiver
+        # thread, so the answers of the module are read by the exchange waiting them. It's taken after
+        # _lock, the receiver can read while a frame is being sent.
+        self._rx_lock = threading.RLock()
+
+        # Set from the AUX rising edge callback, so the waits sleep instead of spinning
+        self._aux_event = threading.Event()
+        self._aux_edge_detect = False
+        self._aux_callbacks = []
 
     def begin(self):
+        self.setup_hardware()
+
+        code = self.set_mode(ModeType.MODE_0_NORMAL)
+        if code != ResponseStatusCode.SUCCESS:
+            return code
+
+        return code
+
+    def setup_hardware(self):
         if not self.uart.is_open:
             self.uart.open()
 
@@ -394,23 +593,74 @@ class LoRaE22:
 
         if self.aux_pin is not None:
             GPIO.setup(self.aux_pin, GPIO.IN)
+            self._setup_aux_event_detect()
         if self.m0_pin is not None and self.m1_pin is not None:
             GPIO.setup(self.m0_pin, GPIO.OUT)
             GPIO.setup(self.m1_pin, GPIO.OUT)
             GPIO.output(self.m0_pin, GPIO.HIGH)
             GPIO.output(self.m1_pin, GPIO.HIGH)
+            self._pin_mode = ModeType.MODE_3_SLEEP
 
         # self.uart.timeout(1000)
 
-        code = self.set_mode(ModeType.MODE_0_NORMAL)
-        if code != ResponseStatusCode.SUCCESS:
+    def set_mode(self, mode: ModeType) -> ResponseStatusCode:
+        with self._lock:
+            return self._set_mode(mode)
+
+    def _set_mode(self, mode: ModeType) -> ResponseStatusCode:
+        if self.is_mode_set(mode):
+            return ResponseStatusCode.E22_SUCCESS
+
+        # Changing mode the module drops the data not yet sent
+        self._wait_tx_buffer(0)
+        # The module accepts the mode switch only when it's idle
+        if self.aux_pin is not None and not self._wait_aux_high(MODE_SWITCH_TIMEOUT):
+            logger.debug("Timeout error!")
+            return ResponseStatusCode.ERR_E22_TIMEOUT
+
+        prev_mode = self.mode
+        code = self.write_mode_pins(mode)
+        if code != ResponseStatusCode.E22_SUCCESS:
             return code
 
-        return code
+        if self.aux_pin is not None:
+            self.managed_delay(MODE_SWITCH_AUX_DELAY)
+            if self._wait_aux_high(MODE_SWITCH_TIMEOUT):
+                self.managed_delay(MODE_SWITCH_SETTLE_TIME)
+                res = ResponseStatusCode.E22_SUCCESS
+            else:
+                logger.debug("Timeout error!")
+                res = ResponseStatusCode.ERR_E22_TIMEOUT
+        else:
+            self.managed_delay(self.get_mode_switch_time(prev_mode, mode))
+            res = ResponseStatusCode.E22_SUCCESS
 
-    def set_mode(self, mode: ModeType) -> ResponseStatusCode:
-        self.managed_delay(40)
+        if res == ResponseStatusCode.E22_SUCCESS:
+            self.mode = mode
+            if mode != ModeType.MODE_2_PROGRAM and self._program_depth == 0:
+                # Program mode left outside a session, nothing to restore
+                self._program_stay = False
+                self._program_return_mode = None
+        else:
+            self.invalidate_configuration()
+
+        return res
+
+    # True if the module is already in the mode and the pins are driven for it
+    def is_mode_set(self, mode: ModeType) -> bool:
+        if self.mode != mode:
+            return False
+        return (self.m0_pin is None and self.m1_pin is None) or self._pin_mode == mode
+
+    # Time (ms) waited without AUX after a mode switch
+    @staticmethod
+    def get_mode_switch_time(prev_mode, mode) -> int:
+        if prev_mode is None or ModeType.MODE_2_PROGRAM in (prev_mode, mode) or \
+                ModeType.MODE_3_SLEEP in (prev_mode, mode):
+            return MODE_SWITCH_RESET_TIME_NO_AUX
+        return MODE_SWITCH_TIME_NO_AUX
 
+    def write_mode_pins(self, mode: ModeType) -> ResponseStatusCode:
         if self.m0_pin is None and self.m1_pin is None:
             logger.debug(
                 "The M0 and M1 pins are not set, which means that you are connecting the pins directly as you need!")
@@ -437,32 +687,71 @@ class LoRaE22:
                 logger.debug("MODE SLEEP!")
             else:
                 return ResponseStatusCode.ERR_E22_INVALID_PARAM
+            self._pin_mode = mode
 
-        self.managed_delay(40)
+        return ResponseStatusCode.E22_SUCCESS
 
-        res = self.wait_complete_response(1000)
-        if res == ResponseStatusCode.E22_SUCCESS:
-            self.mode = mode
+    def _setup_aux_event_detect(self):
+        try:
+            GPIO.remove_event_detect(self.aux_pin)
+            GPIO.add_event_detect(self.aux_pin, GPIO.RISING, callback=self._on_aux_rising)
+            self._aux_edge_detect = True
+        except RuntimeError as e:
+            # Edge detection can be refused (ex. pin already used by another process), poll instead
+            logger.error("AUX edge detection not available, fallback to polling: {}".format(e))
+            self._aux_edge_detect = False
+
+    def _on_aux_rising(self, channel):
+        self._aux_event.set()
+        for callback in self._aux_callbacks:
+            callback()
+
+    @property
+    def aux_edge_detect(self) -> bool:
+        return self._aux_edge_detect
+
+    def add_aux_callback(self, callback):
+        self._aux_callbacks.append(callback)
+
+    def remove_aux_callback(self, callback):
+        if callback in self._aux_callbacks:
+            self._aux_callbacks.remove(callback)
+
+    def _wait_aux_high(self, timeout) -> bool:
+        deadline = time.monotonic() + timeout / 1000
+        # Clear before reading the pin, so an edge between the read and the wait is not lost
+        self._aux_event.clear()
+
+        while GPIO.input(self.aux_pin) == 0:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            if self._aux_edge_detect:
+                self._aux_event.wait(remaining)
+                self._aux_event.clear()
+            else:
+                time.sleep(min(AUX_POLL_INTERVAL, remaining))
 
-        return res
+        return True
 
     @staticmethod
     def managed_delay(timeout):
-        t = round(time.time()*1000)
+        deadline = time.monotonic() + timeout / 1000
 
-        while round(time.time()*1000) - t < timeout:
-            pass
+        remaining = timeout / 1000
+        while remaining > 0:
+            time.sleep(remaining)
+            remaining = deadline - time.monotonic()
 
     def wait_complete_response(self, timeout, wait_no_aux=100) -> ResponseStatusCode:
         result = ResponseStatusCode.E22_SUCCESS
-        t = round(time.time()*1000)
 
         if self.aux_pin is not None:
-            while GPIO.input(self.aux_pin) == 0:
-                if round(time.time()*1000) - t > timeout:
-                    result = ResponseStatusCode.ERR_E22_TIMEOUT
-                    logger.debug("Timeout error!")
-                    return result
+            if not self._wait_aux_high(timeout):
+                result = ResponseStatusCode.ERR_E22_TIMEOUT
+                logger.debug("Timeout error!")
+                return result
 
             logger.debug("AUX HIGH!")
         else:
@@ -478,40 +767,70 @@ class LoRaE22:
             return ResponseStatusCode.ERR_E22_WRONG_UART_CONFIG
         return ResponseStatusCode.E22_SUCCESS
 
+    def invalidate_configuration(self):
+        self._configuration_valid = False
+
+    def refresh_configuration(self) -> (ResponseStatusCode, Configuration):
+        return self.get_configuration(refresh=True)
+
+    def _is_cached_configuration(self, configuration, permanent_configuration) -> bool:
+        if not self._configuration_valid or self.configuration is None:
+            return False
+        if permanent_configuration and not self._configuration_saved:
+            return False
+        # The first 3 bytes are the command
+        return configuration.to_bytes()[3:] == self.configuration.to_bytes()[3:]
+
+    def _store_configuration(self, code, configuration):
+        if code == ResponseStatusCode.E22_SUCCESS:
+            self.configuration = copy.deepcopy(configuration)
+            self._configuration_valid = True
+        else:
+            self._configuration_valid = False
+
     def set_configuration(self, configuration, permanent_configuration=True) -> (ResponseStatusCode, Configuration):
+        if self._is_cached_configuration(configuration, permanent_configuration):
+            logger.debug("Configuration already set")
+            return ResponseStatusCode.E22_SUCCESS, copy.deepcopy(self.configuration)
+
         # code = ResponseStatusCode.E22_SUCCESS
         code = self.check_UART_configuration(ModeType.MODE_2_PROGRAM)
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
 
-        prev_mode = self.mode
-        code = self.set_mode(ModeType.MODE_2_PROGRAM)
+        self.invalidate_configuration()
+
+        code = self._begin_program()
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
 
-        configuration._STARTING_ADDRESS = RegisterAddress.REG_ADDRESS_CFG
-        configuration._LENGTH = PacketLength.PL_CONFIGURATION
+        try:
+            configuration._STARTING_ADDRESS = RegisterAddress.REG_ADDRESS_CFG
+            configuration._LENGTH = PacketLength.PL_CONFIGURATION
 
-        if permanent_configuration:
-            configuration._COMMAND = ProgramCommand.WRITE_CFG_PWR_DWN_SAVE
-        else:
-            configuration._COMMAND = ProgramCommand.WRITE_CFG_PWR_DWN_LOSE
+            if permanent_configuration:
+                configuration._COMMAND = ProgramCommand.WRITE_CFG_PWR_DWN_SAVE
+            else:
+                configuration._COMMAND = ProgramCommand.WRITE_CFG_PWR_DWN_LOSE
 
-        data = configuration.to_bytes()
-        logger.debug("Writing configuration: {} size {}".format(configuration.to_hex_string(), len(data)))
+            data = configuration.to_bytes()
+            logger.debug("Writing configuration: {} size {}".format(configuration.to_hex_string(), len(data)))
 
-        len_writed = self.uart.write(data)
-        if len_writed != len(data):
-            self.set_mode(prev_mode)
-            return code, None
+            # The data received before stays in the parser, the read below gets only the answer
+            self._drain_rx_buffer()
+            len_writed = self.uart.write(data)
+            if len_writed != len(data):
+                return code, None
+
+            self.managed_delay(100)
+
+            data = self.uart.read_all()
+        finally:
+            code = self._end_program()
 
-        code = self.set_mode(prev_mode)
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
 
-        self.managed_delay(100)
-
-        data = self.uart.read_all()
         logger.debug("data: {}".format(data))
         logger.debug("data len: {}".format(len(data)))
 
@@ -530,10 +849,202 @@ class LoRaE22:
                 PacketLength.PL_CONFIGURATION != configuration._LENGTH:
             code = ResponseStatusCode.ERR_E22_HEAD_NOT_RECOGNIZED
 
-        self.clean_UART_buffer()
+        self._store_configuration(code, configuration)
+        if code == ResponseStatusCode.E22_SUCCESS:
+            self._configuration_saved = permanent_configuration
 
         return code, configuration
 
+    # Writes only the registers that differ from the current configuration, with a command
+    # for every group of near registers, and verifies the registers written
+    def update_configuration(self, configuration, permanent_configuration=True) -> (ResponseStatusCode,
+                                                                                    Configuration):
+        if permanent_configuration and not self._configuration_saved:
+            # The registers written before as temporary must be saved too
+            return self.set_configuration(configuration, permanent_configuration)
+
+        code, current = self.get_configuration()
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        old = current.to_bytes()[3:]
+        new = configuration.to_bytes()[3:]
+        runs = self._changed_register_runs(old, new)
+        if not runs:
+            return ResponseStatusCode.E22_SUCCESS, current
+
+        code = self.check_UART_configuration(ModeType.MODE_2_PROGRAM)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        code = self._begin_program()
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        command = ProgramCommand.WRITE_CFG_PWR_DWN_SAVE if permanent_configuration \
+            else ProgramCommand.WRITE_CFG_PWR_DWN_LOSE
+
+        self.invalidate_configuration()
+        try:
+            for start, end in runs:
+                code = self._write_registers(command, RegisterAddress.REG_ADDRESS_CFG + start, new[start:end])
+                if code != ResponseStatusCode.E22_SUCCESS:
+                    return code, None
+        finally:
+            end_code = self._end_program()
+
+        if end_code != ResponseStatusCode.E22_SUCCESS:
+            return end_code, None
+
+        current.from_bytes(current.to_bytes()[:3] + new)
+        self._store_configuration(code, current)
+        if not permanent_configuration:
+            self._configuration_saved = False
+
+        return code, copy.deepcopy(current)
+
+    # Changes the channel with a temporary write of its register only, returns the code and
+    # the time taken (ms). With stay_in_program_mode the module stays in program mode for the
+    # next switches (no mode change delays), exit_program_mode restores the previous mode.
+    def switch_channel(self, chan, stay_in_program_mode=False) -> (ResponseStatusCode, float):
+        start = time.monotonic()
+
+        if not 0 <= chan <= 0xFF:
+            return ResponseStatusCode.ERR_E22_INVALID_PARAM, None
+
+        code = self.check_UART_configuration(ModeType.MODE_2_PROGRAM)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        code = self._begin_program()
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        code = ResponseStatusCode.ERR_E22_UNKNOWN
+        try:
+            code = self._write_registers(ProgramCommand.WRITE_CFG_PWR_DWN_LOSE, RegisterAddress.REG_ADDRESS_CHANNEL,
+                                         [chan])
+        finally:
+            if code == ResponseStatusCode.E22_SUCCESS:
+                # Also with the cache not valid: the saved channel can be different from the one in use
+                self._configuration_saved = False
+                if self._configuration_valid:
+                    self.configuration.CHAN = chan
+            else:
+                self.invalidate_configuration()
+
+            self._program_stay = stay_in_program_mode and code == ResponseStatusCode.E22_SUCCESS
+            end_code = self._end_program()
+
+        if code == ResponseStatusCode.E22_SUCCESS:
+            code = end_code
+
+        return code, (time.monotonic() - start) * 1000
+
+    # Restores the mode left by switch_channel(stay_in_program_mode=True), or at the end of the
+    # program session if called inside one
+    def exit_program_mode(self) -> ResponseStatusCode:
+        with self._lock:
+            self._program_stay = False
+            if self._program_depth > 0:
+                return ResponseStatusCode.E22_SUCCESS
+            return self._restore_program_mode()
+
+    # Enters program mode once for all the operations inside, the previous mode is restored at the end
+    # (also on exceptions). The value is the code of the mode change.
+    # with lora.program_session() as code:
+    #     code, module_information = lora.get_module_information()
+    #     code, configuration = lora.get_configuration()
+    #     ...
+    @contextmanager
+    def program_session(self):
+        code = self.check_UART_configuration(ModeType.MODE_2_PROGRAM)
+        if code == ResponseStatusCode.E22_SUCCESS:
+            code = self._begin_program()
+        try:
+            yield code
+        finally:
+            if code == ResponseStatusCode.E22_SUCCESS:
+                self._end_program()
+
+    # The lock is held from _begin_program to _end_program, the other threads can't send
+    # while the module is in program mode
+    def _begin_program(self) -> ResponseStatusCode:
+        self._lock.acquire()
+        self._rx_lock.acquire()
+        entered = False
+        try:
+            # The mode can have been changed with set_mode after a switch_channel that stayed in program mode
+            prev_mode = self.mode
+            if prev_mode != ModeType.MODE_2_PROGRAM:
+                code = self.set_mode(ModeType.MODE_2_PROGRAM)
+                if code != ResponseStatusCode.E22_SUCCESS:
+                    return code
+            if self._program_return_mode is None:
+                self._program_return_mode = prev_mode
+
+            self._program_depth += 1
+            entered = True
+            return ResponseStatusCode.E22_SUCCESS
+        finally:
+            if not entered:
+                self._rx_lock.release()
+                self._lock.release()
+
+    def _end_program(self) -> ResponseStatusCode:
+        try:
+            self._program_depth -= 1
+            if self._program_depth > 0 or self._program_stay:
+                return ResponseStatusCode.E22_SUCCESS
+            return self._restore_program_mode()
+        finally:
+            self._rx_lock.release()
+            self._lock.release()
+
+    def _restore_program_mode(self) -> ResponseStatusCode:
+        mode = self._program_return_mode
+        self._program_return_mode = None
+        if mode is None or mode == self.mode:
+            return ResponseStatusCode.E22_SUCCESS
+        return self.set_mode(mode)
+
+    @staticmethod
+    def _changed_register_runs(old, new) -> list:
+        runs = []
+        for i in range(len(new)):
+            if old[i] == new[i]:
+                continue
+            if runs and i - runs[-1][1] <= REGISTER_WRITE_HEADER_SIZE:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        return runs
+
+    # Writes data to the registers from address in program mode, the module answers with the registers written
+    def _write_registers(self, command, address, data) -> ResponseStatusCode:
+        data = bytes(data)
+        head = bytes([ProgramCommand.RETURNED_COMMAND, address, len(data)])
+
+        frame = bytes([command, address, len(data)]) + data
+        logger.debug("Writing registers: {}".format(frame.hex()))
+        start = self._drain_rx_buffer()
+        if self.uart.write(frame) != len(frame):
+            return ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH
+
+        deadline = time.monotonic() + PROGRAM_RESPONSE_TIMEOUT / 1000
+        uart_timeout = self.uart.timeout
+        try:
+            response = self._read_frame(
+                lambda: self._parser.pop_sequence(head, len(head) + len(data), start), deadline)
+        finally:
+            self.uart.timeout = uart_timeout
+
+        if response is None:
+            return ResponseStatusCode.ERR_E22_TIMEOUT
+        if response[0][len(head):] != data:
+            return ResponseStatusCode.ERR_E22_WRONG_FORMAT
+        return ResponseStatusCode.E22_SUCCESS
+
     def write_program_command(self, cmd, addr, pl) -> int:
         cmd = bytearray([cmd, addr, pl])
         size = self.uart.write(cmd)
@@ -542,31 +1053,37 @@ class LoRaE22:
 
         return size != 3
 
-    def get_configuration(self) -> (ResponseStatusCode, Configuration):
+    # The configuration is read from the module only when the cached one is not valid or with refresh
+    def get_configuration(self, refresh=False) -> (ResponseStatusCode, Configuration):
+        if not refresh and self._configuration_valid and self.configuration is not None:
+            return ResponseStatusCode.E22_SUCCESS, copy.deepcopy(self.configuration)
+
         code = self.check_UART_configuration(ModeType.MODE_2_PROGRAM)
         logger.debug("check_UART_configuration: {}".format(code))
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
 
-        prev_mode = self.mode
-        code = self.set_mode(ModeType.MODE_2_PROGRAM)
+        code = self._begin_program()
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
         logger.debug("set_mode: {}".format(code))
 
-        self.write_program_command(
-            ProgramCommand.READ_CONFIGURATION,
-            RegisterAddress.REG_ADDRESS_CFG,
-            PacketLength.PL_CONFIGURATION)
-
-        data = self.uart.read_all()
-        logger.debug("data: {}".format(data))
-        logger.debug("data len: {}".format(len(data)))
-
-        logger.debug("model: {}".format(self.model))
-        configuration = Configuration(self.model)
-        configuration.from_bytes(data)
-        code = self.set_mode(prev_mode)
+        try:
+            self._drain_rx_buffer()
+            self.write_program_command(
+                ProgramCommand.READ_CONFIGURATION,
+                RegisterAddress.REG_ADDRESS_CFG,
+                PacketLength.PL_CONFIGURATION)
+
+            data = self.uart.read_all()
+            logger.debug("data: {}".format(data))
+            logger.debug("data len: {}".format(len(data)))
+
+            logger.debug("model: {}".format(self.model))
+            configuration = Configuration(self.model)
+            configuration.from_bytes(data)
+        finally:
+            code = self._end_program()
 
         if ProgramCommand.WRONG_FORMAT == configuration._COMMAND:
             code = ResponseStatusCode.ERR_E22_WRONG_FORMAT
@@ -576,6 +1093,8 @@ class LoRaE22:
                 PacketLength.PL_CONFIGURATION != configuration._LENGTH:
             code = ResponseStatusCode.ERR_E22_HEAD_NOT_RECOGNIZED
 
+        self._store_configuration(code, configuration)
+
         return code, configuration
 
     def get_module_information(self):
@@ -583,27 +1102,25 @@ class LoRaE22:
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
 
-        prev_mode = self.mode
-        code = self.set_mode(ModeType.MODE_2_PROGRAM)
+        code = self._begin_program()
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
 
-        self.write_program_command(
-            ProgramCommand.READ_CONFIGURATION, RegisterAddress.REG_ADDRESS_PID, PacketLength.PL_PID)
+        try:
+            self.write_program_command(
+                ProgramCommand.READ_CONFIGURATION, RegisterAddress.REG_ADDRESS_PID, PacketLength.PL_PID)
+
+            module_information = ModuleInformation()
+            data = self.uart.read(4)
+        finally:
+            code = self._end_program()
 
-        module_information = ModuleInformation()
-        data = self.uart.read(4)
         if data is None or len(data) != 4:
             code = ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH
             return code, None
 
         module_information.from_bytes(data)
 
-        if code != ResponseStatusCode.E22_SUCCESS:
-            self.set_mode(prev_mode)
-            return code, None
-
-        code = self.set_mode(prev_mode)
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None
 
@@ -628,66 +1145,350 @@ class LoRaE22:
                 data[i] = data[i] % 256
         return data
 
-    def receive_dict(self, rssi=False, delimiter=None, size=None) -> (ResponseStatusCode, any, int or None):
-        code, msg, rssi_value = self.receive_message(rssi, delimiter, size)
+    # The dictionary (bytes) must be the same on all the peers, it works better
+    # if it contains the strings that are repeated in the messages
+    def enable_compression(self, dictionary=None, level=9):
+        self.compressor = DeflateCompressor(dictionary, level)
+        self._decompressor = self.compressor
+
+    def disable_compression(self):
+        self.compressor = None
+
+    # The send returns as soon as the frame is in the module buffer, it blocks only when the
+    # buffer is full; the occupancy is estimated from the bytes written and the time on air
+    def enable_pipelining(self, buffer_size=MODULE_BUFFER_SIZE):
+        self.pipelined = True
+        self.buffer_size = buffer_size
+
+    def disable_pipelining(self):
+        self.flush()
+        self.pipelined = False
+
+    # Bytes written that the module is estimated to have not yet sent
+    def get_tx_buffer_occupancy(self) -> int:
+        with self._lock:
+            now = time.monotonic()
+            while self._tx_frames and self._tx_frames[0][0] <= now:
+                self._tx_frames.popleft()
+            return sum(size for _, size in self._tx_frames)
+
+    # Waits until the occupancy of the module buffer is at most size bytes
+    def _wait_tx_buffer(self, size):
+        while self.get_tx_buffer_occupancy() > size:
+            self.managed_delay((self._tx_frames[0][0] - time.monotonic()) * 1000)
+
+    # Waits that all the pipelined frames are sent
+    def flush(self, timeout=1000) -> ResponseStatusCode:
+        with self._lock:
+            if not self._tx_frames:
+                return ResponseStatusCode.E22_SUCCESS
+
+            self._wait_tx_buffer(0)
+            return self.wait_complete_response(timeout)
+
+    # Before every send the ambient noise is read, and the send is deferred with an exponential
+    # backoff while it's above the threshold (dBm). It needs RSSI ambient noise enabled in the
+    # configuration read.
+    def enable_listen_before_talk(self, threshold=LBT_THRESHOLD,
+                                  max_attempts=LBT_MAX_ATTEMPTS) -> ResponseStatusCode:
+        code = self._check_rssi_read()
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code
+
+        self.lbt_threshold = threshold
+        self.lbt_max_attempts = max_attempts
+        return code
+
+    def disable_listen_before_talk(self):
+        self.lbt_threshold = None
+
+    def set_lbt_threshold(self, threshold):
+        self.lbt_threshold = threshold
+
+    @staticmethod
+    def rssi_to_dbm(value) -> int:
+        return -(256 - value)
+
+    # Reads length RSSI registers from address, the module must be in normal mode
+    def read_rssi(self, address, length=1) -> (ResponseStatusCode, bytes):
+        code = self._check_rssi_read()
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        head = bytes([RssiCommand.RETURNED_COMMAND, address, length])
+
+        with self._lock, self._rx_lock:
+            # In another mode the command would be sent on air, or taken as a configuration write
+            if self.mode != ModeType.MODE_0_NORMAL:
+                return ResponseStatusCode.ERR_E22_NOT_SUPPORT, None
+
+            # The answer is searched only after the data received before the command
+            start = self._drain_rx_buffer()
+            deadline = time.monotonic() + RSSI_READ_TIMEOUT / 1000
+            self.uart.write(bytes(RssiCommand.READ_RSSI) + bytes([address, length]))
+
+            uart_timeout = self.uart.timeout
+            try:
+                # The received data that arrives meanwhile stays in the buffer
+                response = self._read_frame(
+                    lambda: self._parser.pop_sequence(head, len(head) + length, start), deadline)
+            finally:
+                self.uart.timeout = uart_timeout
+
+        if response is None:
+            return ResponseStatusCode.ERR_E22_TIMEOUT, None
+        return ResponseStatusCode.E22_SUCCESS, response[0][len(head):]
+
+    # With RSSI ambient noise disabled the command would be sent on air
+    def _check_rssi_read(self) -> ResponseStatusCode:
+        if self.configuration is None or \
+                self.configuration.OPTION.RSSIAmbientNoise != RssiAmbientNoiseEnable.RSSI_AMBIENT_NOISE_ENABLED:
+            return ResponseStatusCode.ERR_E22_NOT_SUPPORT
+        return ResponseStatusCode.E22_SUCCESS
+
+    def get_ambient_noise(self) -> (ResponseStatusCode, int or None):
+        code, values = self.read_rssi(RssiAddress.REG_ADDRESS_AMBIENT_NOISE)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+        return code, self.rssi_to_dbm(values[0])
+
+    # RSSI (dBm) of the last packet received by the module
+    def get_last_rssi(self) -> (ResponseStatusCode, int or None):
+        code, values = self.read_rssi(RssiAddress.REG_ADDRESS_LAST_RSSI)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+        return code, self.rssi_to_dbm(values[0])
+
+    def _wait_channel_clear(self) -> ResponseStatusCode:
+        slot = self.get_air_time(LBT_BACKOFF_SLOT_BYTES)
+        for attempt in range(self.lbt_max_attempts):
+            if self.rssi_sampler is not None:
+                # A sample older than the backoff slot is read again
+                code, noise = self.rssi_sampler.get_ambient_noise(max_age=slot)
+            else:
+                code, noise = self.get_ambient_noise()
+            if code != ResponseStatusCode.E22_SUCCESS:
+                return code
+            if noise <= self.lbt_threshold:
+                return ResponseStatusCode.E22_SUCCESS
+
+            logger.debug("Channel busy ({} dBm), attempt {}".format(noise, attempt + 1))
+            self.managed_delay(random.uniform(0, 2 ** attempt) * slot)
+
+        return ResponseStatusCode.ERR_E22_CHANNEL_BUSY
+
+    def compress_payload(self, data) -> bytes:
+        if self.compressor is None:
+            return data
+        return self.compressor.compress(data)
+
+    def decompress_payload(self, data) -> bytes:
+        return self._decompressor.decompress(data)
+
+    def register_schema(self, schema_id, fields):
+        return self.schemas.register(schema_id, fields)
+
+    def encode_dict(self, dict_message, codec=None) -> bytes:
+        schema = self.schemas.find(dict_message)
+        if schema is not None:
+            try:
+                return self.schemas.encode(schema, dict_message)
+            except struct.error as e:
+                # A value out of the range of its field, send it with the codec
+                logger.debug("Schema {} not applicable: {}".format(schema.schema_id, e))
+
+        return (codec or self.codec).encode(dict_message)
+
+    def decode_dict(self, data, codec=None):
+        if SchemaRegistry.is_schema_frame(data):
+            return self.schemas.decode(data)
+
+        return (codec or self.codec).decode(data)
+
+    def receive_dict(self, rssi=False, delimiter=None, size=None, timeout=None, codec=None) -> (ResponseStatusCode,
+                                                                                                any, int or None):
+        code, data, rssi_value = self.receive_frame(rssi, delimiter, size, timeout)
         if code != ResponseStatusCode.E22_SUCCESS:
             return code, None, None
 
         try:
-            msg = json.loads(msg)
+            msg = self.decode_dict(data, codec)
         except Exception as e:
             logger.error("Error: {}".format(e))
             return ResponseStatusCode.ERR_E22_JSON_PARSE, None, None
 
         return code, msg, rssi_value
 
-    def receive_message(self, rssi=False, delimiter=None, size=None):
+    def receive_message(self, rssi=False, delimiter=None, size=None, timeout=None):
+        code, data, rssi_value = self.receive_frame(rssi, delimiter, size, timeout)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return (code, None, None) if rssi else (code, None)
+
+        data = data.decode('utf-8')
+        msg = data
+
+        return (code, msg, rssi_value) if rssi else (code, msg)
+
+    def receive_frame(self, rssi=False, delimiter=None, size=None, timeout=None) -> (ResponseStatusCode, bytes,
+                                                                                     int or None):
         code = ResponseStatusCode.E22_SUCCESS
         rssi_value = None
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+
+        if isinstance(delimiter, str):
+            delimiter = delimiter.encode('utf-8')
+
+        # Without timeout the one of the serial port is used
+        if deadline is None and self.uart.timeout is not None:
+            deadline = time.monotonic() + self.uart.timeout
+
         if delimiter is not None:
-            data = self._read_until(delimiter)
-            if rssi:
-                rssi_value = data[-1]  # last byte is rssi
-                data = data[:-1]  # remove rssi from data
+            frame = self._receive(lambda: self._parser.pop_delimited(delimiter, rssi), deadline)
         elif size is not None:
-            data = self.uart.read(size)
+            frame = self._receive(lambda: self._parser.pop_size(size), deadline)
+        elif self.length_prefix:
+            frame = self._receive(lambda: self._parser.pop_length_prefixed(rssi), deadline)
         else:
-            data = self.uart.read()
-            time.sleep(0.25)  # wait for the rest of the message
-            while self.uart.in_waiting > 0:
-                data += self.uart.read()
+            frame = self._receive(lambda: self._parser.pop_all(rssi), deadline, until_idle=True)
 
-            self.clean_UART_buffer()
-            if rssi:
-                rssi_value = data[-1]  # last byte is rssi
-                data = data[:-1]  # remove rssi from data
+        data = None
+        if frame is not None:
+            data, rssi_value = frame
 
-        if data is None or len(data) == 0:
-            return (ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH, None, None) \
-                if rssi else (ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH, None)
+        if data is None:
+            code = ResponseStatusCode.ERR_E22_TIMEOUT
+        elif len(data) == 0:
+            code = ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None, None
 
-        data = data.decode('utf-8')
-        msg = data
+        try:
+            data = self.decompress_payload(data)
+        except ValueError as e:
+            logger.error("Error: {}".format(e))
+            return ResponseStatusCode.ERR_E22_WRONG_FORMAT, None, None
+
+        return code, data, rssi_value
+
+    def get_sub_packet_size(self) -> int:
+        sub_packet_setting = self.configuration.OPTION.subPacketSetting if self.configuration is not None \
+            else SubPacketSetting.SPS_240_00
+        return SubPacketSetting.get_size(sub_packet_setting)
+
+    # Bytes of user data that fit in a single frame
+    def get_max_payload_size(self) -> int:
+        return min(MAX_SIZE_TX_PACKET, self.get_sub_packet_size()) - (1 if self.length_prefix else 0)
+
+    def get_air_time(self, payload_size) -> float:
+        configuration = self.configuration if self.configuration is not None else Configuration(self.model)
+        return configuration.get_air_time(payload_size)
+
+    def get_channel(self) -> int:
+        return self.configuration.CHAN if self.configuration is not None else Configuration(self.model).CHAN
+
+    def get_char_time(self) -> float:
+        bits = 10 + (0 if self.uart_parity == 'N' else 1) + (self.uart_stop_bits - 1)
+        return bits * 1000 / self.uart_baudrate
+
+    def get_frame_idle_gap(self) -> float:
+        gap = FRAME_GAP_CHARS * self.get_char_time()
+        if self.aux_pin is None:
+            air_data_rate = self.configuration.SPED.airDataRate if self.configuration is not None \
+                else AirDataRate.AIR_DATA_RATE_010_24
+            gap += FRAME_GAP_AIR_BYTES * 8 * 1000 / AirDataRate.get_bps(air_data_rate)
+        return gap
+
+    # Time (ms) to write a frame on the UART and transmit it
+    def get_frame_send_time(self, size) -> float:
+        return size * self.get_char_time() + self.get_air_time(size)
+
+    def get_frame_output_time(self) -> float:
+        return (MAX_SIZE_TX_PACKET + FRAME_GAP_CHARS) * self.get_char_time()
+
+    # Reads what is available (at least one byte) in the receive buffer, the caller must restore
+    # the timeout of the serial port. With a None deadline the timeout of the serial port is used.
+    def _fill_rx_buffer(self, deadline) -> bool:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self.uart.timeout = remaining
+
+        chunk = self.uart.read(max(1, self.uart.in_waiting))
+        if not chunk:
+            return False
+
+        self._parser.feed(chunk)
+        return True
+
+    # Moves the bytes already received by the serial port to the parser, returns the parser size
+    def _drain_rx_buffer(self) -> int:
+        waiting = self.uart.in_waiting
+        if waiting:
+            self._parser.feed(self.uart.read(waiting))
+        return len(self._parser)
+
+    def _read_until_idle(self):
+        # AUX stays low while the module outputs the received data
+        if self.aux_pin is not None:
+            self._wait_aux_high(self.get_frame_output_time())
 
-        return (code, msg, rssi_value) if rssi else (code, msg)
+        self.uart.timeout = self.get_frame_idle_gap() / 1000
+        while self._fill_rx_buffer(None):
+            pass
+
+    # The read lock is taken only to read what has arrived and to pop the frame, with until_idle the
+    # bytes are read until the line is silent
+    def _receive(self, pop, deadline, until_idle=False):
+        while True:
+            with self._rx_lock:
+                uart_timeout = self.uart.timeout
+                try:
+                    if until_idle:
+                        if len(self._parser) > 0 or self.uart.in_waiting:
+                            self._read_until_idle()
+                    else:
+                        self._drain_rx_buffer()
+                    frame = pop()
+                finally:
+                    self.uart.timeout = uart_timeout
+
+                if frame is not None:
+                    return frame
+                size = len(self._parser)
+
+            if not self._wait_rx_data(size, deadline):
+                return None
+
+    # Waits new bytes on the serial port (or in the parser, read by another thread) without reading them
+    def _wait_rx_data(self, size, deadline) -> bool:
+        while self.uart.in_waiting == 0 and len(self._parser) == size:
+            interval = RX_POLL_INTERVAL
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                interval = min(interval, remaining)
+            time.sleep(interval)
+        return True
+
+    def _read_frame(self, pop, deadline):
+        while True:
+            frame = pop()
+            if frame is not None:
+                return frame
+            if not self._fill_rx_buffer(deadline):
+                return None
 
     def clean_UART_buffer(self):
+        self._parser.clear()
         self.uart.read_all()
 
-    def _read_until(self, terminator='\n') -> bytes:
-        line = b''
-        while True:
-            c = self.uart.read(1)
-            if c == terminator:
-                break
-            line += c
-        return line
-
     def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
         return self._send_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
 
-    def send_broadcast_dict(self, CHAN, dict_message) -> ResponseStatusCode:
-        message = json.dumps(dict_message)
+    def send_broadcast_dict(self, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        message = self.encode_dict(dict_message, codec)
         return self._send_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
 
     def send_transparent_message(self, message) -> ResponseStatusCode:
@@ -696,32 +1497,94 @@ class LoRaE22:
     def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
         return self._send_message(message, ADDH, ADDL, CHAN)
 
-    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message) -> ResponseStatusCode:
-        message = json.dumps(dict_message)
+    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        message = self.encode_dict(dict_message, codec)
         return self._send_message(message, ADDH, ADDL, CHAN)
 
-    def send_transparent_dict(self, dict_message) -> ResponseStatusCode:
-        message = json.dumps(dict_message)
+    def send_transparent_dict(self, dict_message, codec=None) -> ResponseStatusCode:
+        message = self.encode_dict(dict_message, codec)
         return self._send_message(message)
 
-    def _send_message(self, message, ADDH=None, ADDL=None, CHAN=None) -> ResponseStatusCode:
-        result = ResponseStatusCode.E22_SUCCESS
+    # The async variants return a Future completed with the ResponseStatusCode when the frame
+    # has left the module (AUX high, or the estimated send time without AUX), the sends are done
+    # in order by a worker thread. Under asyncio use asyncio.wrap_future or AsyncLoRaE22.
+    # The other calls can be made meanwhile: the worker waits the end of a configuration read or
+    # write (and of a receive), and a send while the module is in program mode is refused.
+    def send_broadcast_message_async(self, CHAN, message) -> Future:
+        return self._submit(self.send_broadcast_message, CHAN, message)
+
+    def send_broadcast_dict_async(self, CHAN, dict_message, codec=None) -> Future:
+        return self._submit(self.send_broadcast_dict, CHAN, dict_message, codec)
+
+    def send_transparent_message_async(self, message) -> Future:
+        return self._submit(self.send_transparent_message, message)
 
-        size_ = len(message.encode('utf-8'))
-        if size_ > MAX_SIZE_TX_PACKET:
-            return ResponseStatusCode.ERR_E22_PACKET_TOO_BIG
+    def send_fixed_message_async(self, ADDH, ADDL, CHAN, message) -> Future:
+        return self._submit(self.send_fixed_message, ADDH, ADDL, CHAN, message)
+
+    def send_fixed_dict_async(self, ADDH, ADDL, CHAN, dict_message, codec=None) -> Future:
+        return self._submit(self.send_fixed_dict, ADDH, ADDL, CHAN, dict_message, codec)
+
+    def send_transparent_dict_async(self, dict_message, codec=None) -> Future:
+        return self._submit(self.send_transparent_dict, dict_message, codec)
+
+    def _submit(self, send, *args) -> Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='LoRaE22Send')
+        return self._executor.submit(send, *args)
+
+    def build_frame(self, message, ADDH=None, ADDL=None, CHAN=None) -> (ResponseStatusCode, bytes):
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        else:
+            message = bytes(message)
+
+        message = self.compress_payload(message)
+
+        if len(message) + (1 if self.length_prefix else 0) > MAX_SIZE_TX_PACKET:
+            return ResponseStatusCode.ERR_E22_PACKET_TOO_BIG, None
+
+        if self.length_prefix:
+            message = bytes([len(message)]) + message
 
         if ADDH is not None and ADDL is not None and CHAN is not None:
-            if isinstance(message, str):
-                message = message.encode('utf-8')
             dataarray = bytes([ADDH, ADDL, CHAN]) + message
-            dataarray = LoRaE22._normalize_array(dataarray)
-            lenMS = self.uart.write(bytes(dataarray))
-            size_ += 3
-        elif isinstance(message, str):
-            lenMS = self.uart.write(message.encode('utf-8'))
-        else:
-            lenMS = self.uart.write(bytes(message))
+            return ResponseStatusCode.E22_SUCCESS, bytes(LoRaE22._normalize_array(dataarray))
+
+        return ResponseStatusCode.E22_SUCCESS, bytes(message)
+
+    def _send_message(self, message, ADDH=None, ADDL=None, CHAN=None) -> ResponseStatusCode:
+        result, frame = self.build_frame(message, ADDH, ADDL, CHAN)
+        if result != ResponseStatusCode.E22_SUCCESS:
+            return result
+
+        return self.write_frame(frame)
+
+    # Writes a frame returned by build_frame and waits that the module sends it,
+    # or only that it fits in the module buffer with the pipelined send
+    def write_frame(self, frame) -> ResponseStatusCode:
+        with self._lock:
+            return self._write_frame(frame)
+
+    def _write_frame(self, frame) -> ResponseStatusCode:
+        # In program mode (also after switch_channel(stay_in_program_mode=True)) the frame would be
+        # taken as a command
+        if self.mode == ModeType.MODE_2_PROGRAM:
+            return ResponseStatusCode.ERR_E22_NOT_SUPPORT
+
+        result = ResponseStatusCode.E22_SUCCESS
+
+        size_ = len(frame)
+        if self.pipelined:
+            self._wait_tx_buffer(self.buffer_size - size_)
+
+        # While the module sends the previous frames the noise is our transmission
+        if self.lbt_threshold is not None and self.get_tx_buffer_occupancy() == 0:
+            result = self._wait_channel_clear()
+            if result != ResponseStatusCode.E22_SUCCESS:
+                return result
+
+        lenMS = self.uart.write(frame)
 
         if lenMS != size_:
             logger.debug("Send... len:", lenMS, " size:", size_)
@@ -732,19 +1595,29 @@ class LoRaE22:
         if result != ResponseStatusCode.E22_SUCCESS:
             return result
 
-        result = self.wait_complete_response(1000)
+        if self.pipelined:
+            # On air after the frames before it, or when it's arrived on the UART
+            start = time.monotonic() + size_ * self.get_char_time() / 1000
+            if self._tx_frames:
+                start = max(start, self._tx_frames[-1][0])
+            self._tx_frames.append((start + self.get_air_time(size_) / 1000, size_))
+            return result
+
+        result = self.wait_complete_response(1000, wait_no_aux=self.get_frame_send_time(size_))
         if result != ResponseStatusCode.E22_SUCCESS:
             return result
-        logger.debug("Clear buffer...")
-        self.clean_UART_buffer()
 
         logger.debug("ok!")
         return result
 
     def available(self) -> int:
-        return self.uart.in_waiting
+        return len(self._parser) + self.uart.in_waiting
 
     def end(self) -> ResponseStatusCode:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
         try:
             if self.uart is not None:
                 self.uart.close()
@@ -0,0 +1,370 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - asyncio driver
+#
+# AsyncLoRaE22 exposes the LoRaE22 operations as coroutines, so one event loop can drive
+# the module together with other network I/O. The serial file descriptor is read with
+# loop.add_reader (pyserial opens it non-blocking) and the AUX rising edge is forwarded
+# to the loop from the GPIO edge callback.
+#############################################################################################
+
+import asyncio
+import copy
+import os
+
+from RPi import GPIO
+
+from lora_e22 import LoRaE22, Configuration, FrameParser, BROADCAST_ADDRESS, AUX_POLL_INTERVAL, \
+    MODE_SWITCH_AUX_DELAY, MODE_SWITCH_SETTLE_TIME, MODE_SWITCH_TIMEOUT, logger
+from lora_e22_operation_constant import ResponseStatusCode, ModeType, ProgramCommand, RegisterAddress, \
+    PacketLength
+
+READ_CHUNK_SIZE = 4096
+
+
+class AsyncLoRaE22:
+    def __init__(self, model, uart, aux_pin=None, m0_pin=None, m1_pin=None,
+                 gpio_mode=GPIO.BCM, length_prefix=False, codec=None):
+        self.lora = LoRaE22(model, uart, aux_pin, m0_pin, m1_pin, gpio_mode, length_prefix, codec)
+        self.uart = uart
+        self.model = model
+        self.aux_pin = aux_pin
+
+        self._loop = None
+        self._fd = None
+        self._parser = FrameParser()
+        self._rx_event = None
+        self._aux_event = None
+        # Held by the mode changes, the program exchanges and the sends, so the coroutines
+        # don't interleave on the UART and on the mode pins
+        self._lock = None
+
+    @property
+    def mode(self):
+        return self.lora.mode
+
+    async def begin(self) -> ResponseStatusCode:
+        self._loop = asyncio.get_running_loop()
+        self._rx_event = asyncio.Event()
+        self._aux_event = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+        self.lora.setup_hardware()
+        if self.aux_pin is not None:
+            self.lora.add_aux_callback(self._on_aux_rising)
+
+        self._fd = self.uart.fileno()
+        os.set_blocking(self._fd, False)
+        self._loop.add_reader(self._fd, self._on_readable)
+
+        return await self.set_mode(ModeType.MODE_0_NORMAL)
+
+    def _on_aux_rising(self):
+        # Called from the GPIO edge thread
+        self._loop.call_soon_threadsafe(self._aux_event.set)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, READ_CHUNK_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+
+        if data:
+            self._parser.feed(data)
+            self._rx_event.set()
+
+    async def _wait_frame(self, pop, timeout):
+        deadline = None if timeout is None else self._loop.time() + timeout / 1000
+
+        while True:
+            frame = pop()
+            if frame is not None:
+                return frame
+
+            self._rx_event.clear()
+            if deadline is None:
+                await self._rx_event.wait()
+                continue
+
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._rx_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return pop()
+
+    async def _wait_rx_idle(self):
+        # AUX stays low while the module outputs the received data
+        if self.aux_pin is not None:
+            await self._wait_aux_high(self.lora.get_frame_output_time())
+
+        gap = self.lora.get_frame_idle_gap() / 1000
+        while True:
+            self._rx_event.clear()
+            try:
+                await asyncio.wait_for(self._rx_event.wait(), gap)
+            except asyncio.TimeoutError:
+                return
+
+    async def _wait_aux_high(self, timeout) -> bool:
+        deadline = self._loop.time() + timeout / 1000
+        self._aux_event.clear()
+
+        while GPIO.input(self.aux_pin) == 0:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return False
+
+            if self.lora.aux_edge_detect:
+                try:
+                    await asyncio.wait_for(self._aux_event.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                self._aux_event.clear()
+            else:
+                await asyncio.sleep(min(AUX_POLL_INTERVAL, remaining))
+
+        return True
+
+    async def wait_complete_response(self, timeout, wait_no_aux=100) -> ResponseStatusCode:
+        if self.aux_pin is not None:
+            if not await self._wait_aux_high(timeout):
+                logger.debug("Timeout error!")
+                return ResponseStatusCode.ERR_E22_TIMEOUT
+            logger.debug("AUX HIGH!")
+        else:
+            await asyncio.sleep(wait_no_aux / 1000)
+            logger.debug("Wait no AUX pin!")
+
+        await asyncio.sleep(0.02)
+        return ResponseStatusCode.E22_SUCCESS
+
+    async def set_mode(self, mode: ModeType) -> ResponseStatusCode:
+        async with self._lock:
+            return await self._set_mode(mode)
+
+    async def _set_mode(self, mode: ModeType) -> ResponseStatusCode:
+        if self.lora.is_mode_set(mode):
+            return ResponseStatusCode.E22_SUCCESS
+
+        if self.aux_pin is not None and not await self._wait_aux_high(MODE_SWITCH_TIMEOUT):
+            logger.debug("Timeout error!")
+            return ResponseStatusCode.ERR_E22_TIMEOUT
+
+        prev_mode = self.lora.mode
+        code = self.lora.write_mode_pins(mode)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code
+
+        if self.aux_pin is not None:
+            await asyncio.sleep(MODE_SWITCH_AUX_DELAY / 1000)
+            if await self._wait_aux_high(MODE_SWITCH_TIMEOUT):
+                await asyncio.sleep(MODE_SWITCH_SETTLE_TIME / 1000)
+                res = ResponseStatusCode.E22_SUCCESS
+            else:
+                logger.debug("Timeout error!")
+                res = ResponseStatusCode.ERR_E22_TIMEOUT
+        else:
+            await asyncio.sleep(self.lora.get_mode_switch_time(prev_mode, mode) / 1000)
+            res = ResponseStatusCode.E22_SUCCESS
+
+        if res == ResponseStatusCode.E22_SUCCESS:
+            self.lora.mode = mode
+        else:
+            self.lora.invalidate_configuration()
+
+        return res
+
+    async def _program_exchange(self, command, response_size) -> (ResponseStatusCode, bytes):
+        code = self.lora.check_UART_configuration(ModeType.MODE_2_PROGRAM)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        async with self._lock:
+            return await self._locked_program_exchange(command, response_size)
+
+    async def _locked_program_exchange(self, command, response_size) -> (ResponseStatusCode, bytes):
+        prev_mode = self.lora.mode
+        code = await self._set_mode(ModeType.MODE_2_PROGRAM)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None
+
+        # The answer repeats the address and the length of the command, it's searched after the
+        # data already received, that stays in the buffer
+        head = bytes([ProgramCommand.RETURNED_COMMAND, command[1], command[2]])
+        start = len(self._parser)
+        self.uart.write(command)
+        frame = await self._wait_frame(lambda: self._parser.pop_sequence(head, response_size, start), 1000)
+
+        # Before begin the previous mode is not known, the module stays in program mode
+        if prev_mode is not None:
+            code = await self._set_mode(prev_mode)
+        if frame is None:
+            return ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH, None
+
+        return code, frame[0]
+
+    async def get_configuration(self, refresh=False) -> (ResponseStatusCode, Configuration):
+        if not refresh and self.lora._configuration_valid and self.lora.configuration is not None:
+            return ResponseStatusCode.E22_SUCCESS, copy.deepcopy(self.lora.configuration)
+
+        command = bytes([ProgramCommand.READ_CONFIGURATION, RegisterAddress.REG_ADDRESS_CFG,
+                         PacketLength.PL_CONFIGURATION])
+        code, data = await self._program_exchange(command, PacketLength.PL_CONFIGURATION + 3)
+        if data is None:
+            return code, None
+
+        configuration = Configuration(self.model)
+        configuration.from_bytes(data)
+
+        code = self._check_configuration_head(code, configuration)
+        self.lora._store_configuration(code, configuration)
+
+        return code, configuration
+
+    async def set_configuration(self, configuration, permanent_configuration=True) -> (ResponseStatusCode,
+                                                                                       Configuration):
+        if self.lora._is_cached_configuration(configuration, permanent_configuration):
+            return ResponseStatusCode.E22_SUCCESS, copy.deepcopy(self.lora.configuration)
+
+        self.lora.invalidate_configuration()
+        configuration._STARTING_ADDRESS = RegisterAddress.REG_ADDRESS_CFG
+        configuration._LENGTH = PacketLength.PL_CONFIGURATION
+
+        if permanent_configuration:
+            configuration._COMMAND = ProgramCommand.WRITE_CFG_PWR_DWN_SAVE
+        else:
+            configuration._COMMAND = ProgramCommand.WRITE_CFG_PWR_DWN_LOSE
+
+        logger.debug("Writing configuration: {}".format(configuration.to_hex_string()))
+        code, data = await self._program_exchange(configuration.to_bytes(), PacketLength.PL_CONFIGURATION + 3)
+        if data is None:
+            return code, None
+
+        configuration = Configuration(self.model)
+        configuration.from_bytes(data)
+
+        code = self._check_configuration_head(code, configuration)
+        self.lora._store_configuration(code, configuration)
+        if code == ResponseStatusCode.E22_SUCCESS:
+            self.lora._configuration_saved = permanent_configuration
+
+        return code, configuration
+
+    @staticmethod
+    def _check_configuration_head(code, configuration) -> ResponseStatusCode:
+        if ProgramCommand.WRONG_FORMAT == configuration._COMMAND:
+            code = ResponseStatusCode.ERR_E22_WRONG_FORMAT
+        if ProgramCommand.RETURNED_COMMAND != configuration._COMMAND or \
+                RegisterAddress.REG_ADDRESS_CFG != configuration._STARTING_ADDRESS or \
+                PacketLength.PL_CONFIGURATION != configuration._LENGTH:
+            code = ResponseStatusCode.ERR_E22_HEAD_NOT_RECOGNIZED
+        return code
+
+    async def receive_dict(self, rssi=False, delimiter=None, size=None, timeout=None,
+                           codec=None) -> (ResponseStatusCode, any, int or None):
+        code, data, rssi_value = await self.receive_frame(rssi, delimiter, size, timeout)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None, None
+
+        try:
+            msg = self.lora.decode_dict(data, codec)
+        except Exception as e:
+            logger.error("Error: {}".format(e))
+            return ResponseStatusCode.ERR_E22_JSON_PARSE, None, None
+
+        return code, msg, rssi_value
+
+    async def receive_message(self, rssi=False, delimiter=None, size=None, timeout=None):
+        code, data, rssi_value = await self.receive_frame(rssi, delimiter, size, timeout)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return (code, None, None) if rssi else (code, None)
+
+        msg = data.decode('utf-8')
+        return (code, msg, rssi_value) if rssi else (code, msg)
+
+    async def receive_frame(self, rssi=False, delimiter=None, size=None, timeout=None) -> (ResponseStatusCode,
+                                                                                           bytes, int or None):
+        if isinstance(delimiter, str):
+            delimiter = delimiter.encode('utf-8')
+
+        if delimiter is not None:
+            frame = await self._wait_frame(lambda: self._parser.pop_delimited(delimiter, rssi), timeout)
+        elif size is not None:
+            frame = await self._wait_frame(lambda: self._parser.pop_size(size), timeout)
+        elif self.lora.length_prefix:
+            frame = await self._wait_frame(lambda: self._parser.pop_length_prefixed(rssi), timeout)
+        else:
+            frame = None
+            if await self._wait_frame(lambda: True if len(self._parser) > 0 else None, timeout):
+                await self._wait_rx_idle()
+                frame = self._parser.pop_all(rssi)
+
+        if frame is None:
+            return ResponseStatusCode.ERR_E22_TIMEOUT, None, None
+
+        data, rssi_value = frame
+        if len(data) == 0:
+            return ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH, None, None
+
+        try:
+            data = self.lora.decompress_payload(data)
+        except ValueError as e:
+            logger.error("Error: {}".format(e))
+            return ResponseStatusCode.ERR_E22_WRONG_FORMAT, None, None
+
+        return ResponseStatusCode.E22_SUCCESS, data, rssi_value
+
+    async def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
+        return await self._send_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    async def send_broadcast_dict(self, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        message = self.lora.encode_dict(dict_message, codec)
+        return await self._send_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    async def send_transparent_message(self, message) -> ResponseStatusCode:
+        return await self._send_message(message)
+
+    async def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        return await self._send_message(message, ADDH, ADDL, CHAN)
+
+    async def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        message = self.lora.encode_dict(dict_message, codec)
+        return await self._send_message(message, ADDH, ADDL, CHAN)
+
+    async def send_transparent_dict(self, dict_message, codec=None) -> ResponseStatusCode:
+        message = self.lora.encode_dict(dict_message, codec)
+        return await self._send_message(message)
+
+    async def _send_message(self, message, ADDH=None, ADDL=None, CHAN=None) -> ResponseStatusCode:
+        code, frame = self.lora.build_frame(message, ADDH, ADDL, CHAN)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code
+
+        async with self._lock:
+            return await self._write_frame(frame)
+
+    async def _write_frame(self, frame) -> ResponseStatusCode:
+        # Checked with the lock held, a mode change in progress has ended
+        if self.lora.mode == ModeType.MODE_2_PROGRAM:
+            return ResponseStatusCode.ERR_E22_NOT_SUPPORT
+
+        len_writed = self.uart.write(frame)
+        if len_writed != len(frame):
+            logger.debug("Send... len:", len_writed, " size:", len(frame))
+            if len_writed == 0:
+                return ResponseStatusCode.ERR_E22_NO_RESPONSE_FROM_DEVICE
+            return ResponseStatusCode.ERR_E22_DATA_SIZE_NOT_MATCH
+
+        return await self.wait_complete_response(1000, wait_no_aux=self.lora.get_frame_send_time(len(frame)))
+
+    def available(self) -> int:
+        return len(self._parser)
+
+    async def end(self) -> ResponseStatusCode:
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._fd = None
+        self.lora.remove_aux_callback(self._on_aux_rising)
+
+        return self.lora.end()
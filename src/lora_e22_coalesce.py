@@ -0,0 +1,228 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - coalescing
+#
+# LoRaE22Coalescer batches the small messages sent to the same destination in a single frame,
+# up to the sub packet size of the module, so they share the preamble, the fixed header and
+# the wait of the module. The frame is sent when the next message doesn't fit or after
+# max_delay ms from its first message.
+# Frame: MARKER COALESCED length message [length message ...]
+# A frame with only one message is sent as it is.
+#############################################################################################
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from lora_e22 import BROADCAST_ADDRESS, logger
+from lora_e22_operation_constant import ResponseStatusCode, FrameHeader
+
+COALESCED_HEADER_SIZE = 2
+
+# Longest wait of the thread, it bounds the time needed to stop it
+COALESCER_WAIT_INTERVAL = 200
+
+
+class CoalescedFrame:
+    def __init__(self, created):
+        self.created = created  # time.monotonic() of the first message
+        self.messages = []
+        self.size = COALESCED_HEADER_SIZE
+
+    def frame(self) -> bytes:
+        if len(self.messages) == 1 and self.messages[0][:1] != bytes([FrameHeader.MARKER]):
+            return self.messages[0]
+
+        return bytes([FrameHeader.MARKER, FrameHeader.COALESCED]) + \
+            b''.join(bytes([len(message)]) + message for message in self.messages)
+
+
+class LoRaE22Coalescer:
+    def __init__(self, lora, max_delay=100):
+        self.lora = lora
+        self.max_delay = max_delay
+
+        self._frames = OrderedDict()  # (ADDH, ADDL, CHAN) -> CoalescedFrame, in order of creation
+        self._received = deque()
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='LoRaE22Coalescer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+        self.flush()
+
+    @staticmethod
+    def is_coalesced(data) -> bool:
+        return len(data) >= COALESCED_HEADER_SIZE and data[0] == FrameHeader.MARKER and \
+            data[1] == FrameHeader.COALESCED
+
+    # Messages of a received frame, a frame not coalesced is a single message
+    @staticmethod
+    def split(data) -> list:
+        if not LoRaE22Coalescer.is_coalesced(data):
+            return [data]
+
+        messages = []
+        offset = COALESCED_HEADER_SIZE
+        while offset < len(data):
+            size = data[offset]
+            offset += 1
+            if offset + size > len(data):
+                logger.debug("Truncated message in coalesced frame")
+                break
+            messages.append(bytes(data[offset:offset + size]))
+            offset += size
+        return messages
+
+    def get_max_message_size(self) -> int:
+        return self.lora.get_max_payload_size() - COALESCED_HEADER_SIZE - 1
+
+    def send_transparent_message(self, message) -> ResponseStatusCode:
+        return self._queue_message(message, None, None, None)
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        return self._queue_message(message, ADDH, ADDL, CHAN)
+
+    def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
+        return self._queue_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    def send_transparent_dict(self, dict_message, codec=None) -> ResponseStatusCode:
+        return self._queue_message(self.lora.encode_dict(dict_message, codec), None, None, None)
+
+    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        return self._queue_message(self.lora.encode_dict(dict_message, codec), ADDH, ADDL, CHAN)
+
+    def send_broadcast_dict(self, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        return self._queue_message(self.lora.encode_dict(dict_message, codec),
+                                   BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    def _queue_message(self, message, ADDH, ADDL, CHAN) -> ResponseStatusCode:
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+        message = bytes(message)
+        address = (ADDH, ADDL, CHAN)
+
+        if len(message) > self.get_max_message_size():
+            # Sent alone, after the messages queued before it
+            code = self._flush_address(address)
+            if code != ResponseStatusCode.E22_SUCCESS:
+                return code
+            return self._send(address, message)
+
+        full = None
+        with self._condition:
+            coalesced_frame = self._frames.get(address)
+            if coalesced_frame is not None and \
+                    coalesced_frame.size + 1 + len(message) > self.lora.get_max_payload_size():
+                full = self._frames.pop(address)
+                coalesced_frame = None
+
+            if coalesced_frame is None:
+                coalesced_frame = CoalescedFrame(time.monotonic())
+                self._frames[address] = coalesced_frame
+                self._condition.notify()
+            coalesced_frame.messages.append(message)
+            coalesced_frame.size += 1 + len(message)
+
+        if full is not None:
+            return self._send(address, full.frame())
+        return ResponseStatusCode.E22_SUCCESS
+
+    # Sends now all the messages queued
+    def flush(self) -> ResponseStatusCode:
+        with self._condition:
+            frames = list(self._frames.items())
+            self._frames.clear()
+
+        result = ResponseStatusCode.E22_SUCCESS
+        for address, coalesced_frame in frames:
+            code = self._send(address, coalesced_frame.frame())
+            if code != ResponseStatusCode.E22_SUCCESS:
+                result = code
+        return result
+
+    def _flush_address(self, address) -> ResponseStatusCode:
+        with self._condition:
+            coalesced_frame = self._frames.pop(address, None)
+
+        if coalesced_frame is None:
+            return ResponseStatusCode.E22_SUCCESS
+        return self._send(address, coalesced_frame.frame())
+
+    def _send(self, address, frame) -> ResponseStatusCode:
+        with self._send_lock:
+            ADDH, ADDL, CHAN = address
+            if CHAN is None:
+                return self.lora.send_transparent_message(frame)
+            return self.lora.send_fixed_message(ADDH, ADDL, CHAN, frame)
+
+    def _run(self):
+        while True:
+            expired = []
+            with self._condition:
+                if not self._running:
+                    return
+
+                now = time.monotonic()
+                wait = COALESCER_WAIT_INTERVAL / 1000
+                for address, coalesced_frame in list(self._frames.items()):
+                    remaining = coalesced_frame.created + self.max_delay / 1000 - now
+                    if remaining <= 0:
+                        expired.append((address, self._frames.pop(address)))
+                    else:
+                        wait = min(wait, remaining)
+
+                if not expired:
+                    self._condition.wait(wait)
+                    continue
+
+            for address, coalesced_frame in expired:
+                code = self._send(address, coalesced_frame.frame())
+                if code != ResponseStatusCode.E22_SUCCESS:
+                    logger.error("Error: {}".format(ResponseStatusCode.get_description(code)))
+
+    def receive_frame(self, rssi=False, timeout=None) -> (ResponseStatusCode, bytes, int or None):
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+
+        while not self._received:
+            remaining = None
+            if deadline is not None:
+                remaining = (deadline - time.monotonic()) * 1000
+                if remaining <= 0:
+                    return ResponseStatusCode.ERR_E22_TIMEOUT, None, None
+
+            code, data, rssi_value = self.lora.receive_frame(rssi, timeout=remaining)
+            if code != ResponseStatusCode.E22_SUCCESS:
+                return code, None, None
+
+            # The messages of a frame share its RSSI
+            for message in self.split(data):
+                self._received.append((message, rssi_value))
+
+        message, rssi_value = self._received.popleft()
+        return ResponseStatusCode.E22_SUCCESS, message, rssi_value
+
+    def receive_message(self, rssi=False, timeout=None):
+        code, data, rssi_value = self.receive_frame(rssi, timeout)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return (code, None, None) if rssi else (code, None)
+
+        msg = data.decode('utf-8')
+        return (code, msg, rssi_value) if rssi else (code, msg)
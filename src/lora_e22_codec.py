@@ -0,0 +1,332 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - codecs
+#
+# Codecs used by send_*_dict and receive_dict to put a dictionary on air, and the
+# optional compression of the payloads.
+# A codec has encode(obj) -> bytes and decode(bytes) -> obj, and raises ValueError
+# if the data can't be decoded.
+#############################################################################################
+
+import json
+import struct
+import zlib
+
+from lora_e22_operation_constant import FrameHeader
+
+
+class JsonCodec:
+    # compact removes the spaces after the separators
+    def __init__(self, compact=False):
+        self.separators = (',', ':') if compact else None
+
+    def encode(self, obj) -> bytes:
+        return json.dumps(obj, separators=self.separators).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MessagePackCodec:
+    # Self-contained encoder/decoder of the MessagePack format (nil, bool, int, float, str,
+    # bin, array and map), the messages can be decoded by any MessagePack library.
+    # single_float sends the floats on 4 bytes instead of 8, losing precision.
+    def __init__(self, single_float=False):
+        self.single_float = single_float
+
+    def encode(self, obj) -> bytes:
+        buffer = bytearray()
+        self._encode(obj, buffer)
+        return bytes(buffer)
+
+    def decode(self, data):
+        try:
+            obj, offset = self._decode(data, 0)
+        except (IndexError, TypeError, struct.error, UnicodeDecodeError) as e:
+            raise ValueError("Invalid MessagePack data: {}".format(e))
+
+        if offset != len(data):
+            raise ValueError("Invalid MessagePack data: {} bytes after the end".format(len(data) - offset))
+        return obj
+
+    def _encode(self, obj, buffer):
+        if obj is None:
+            buffer.append(0xC0)
+        elif obj is True:
+            buffer.append(0xC3)
+        elif obj is False:
+            buffer.append(0xC2)
+        elif isinstance(obj, int):
+            self._encode_int(obj, buffer)
+        elif isinstance(obj, float):
+            if self.single_float:
+                buffer += struct.pack('>Bf', 0xCA, obj)
+            else:
+                buffer += struct.pack('>Bd', 0xCB, obj)
+        elif isinstance(obj, str):
+            data = obj.encode('utf-8')
+            size = len(data)
+            if size < 32:
+                buffer.append(0xA0 | size)
+            elif size < 0x100:
+                buffer += struct.pack('>BB', 0xD9, size)
+            elif size < 0x10000:
+                buffer += struct.pack('>BH', 0xDA, size)
+            else:
+                buffer += struct.pack('>BI', 0xDB, size)
+            buffer += data
+        elif isinstance(obj, (bytes, bytearray)):
+            size = len(obj)
+            if size < 0x100:
+                buffer += struct.pack('>BB', 0xC4, size)
+            elif size < 0x10000:
+                buffer += struct.pack('>BH', 0xC5, size)
+            else:
+                buffer += struct.pack('>BI', 0xC6, size)
+            buffer += obj
+        elif isinstance(obj, (list, tuple)):
+            self._encode_size(len(obj), 0x90, 0xDC, buffer)
+            for item in obj:
+                self._encode(item, buffer)
+        elif isinstance(obj, dict):
+            self._encode_size(len(obj), 0x80, 0xDE, buffer)
+            for key, value in obj.items():
+                self._encode(key, buffer)
+                self._encode(value, buffer)
+        else:
+            raise TypeError("Type not supported: {}".format(type(obj)))
+
+    @staticmethod
+    def _encode_size(size, fix, code, buffer):
+        if size < 16:
+            buffer.append(fix | size)
+        elif size < 0x10000:
+            buffer += struct.pack('>BH', code, size)
+        else:
+            buffer += struct.pack('>BI', code + 1, size)
+
+    @staticmethod
+    def _encode_int(value, buffer):
+        if 0 <= value < 0x80:
+            buffer.append(value)
+        elif -32 <= value < 0:
+            buffer.append(value & 0xFF)
+        elif 0 <= value < 0x100:
+            buffer += struct.pack('>BB', 0xCC, value)
+        elif 0 <= value < 0x10000:
+            buffer += struct.pack('>BH', 0xCD, value)
+        elif 0 <= value < 0x100000000:
+            buffer += struct.pack('>BI', 0xCE, value)
+        elif 0 <= value < 0x10000000000000000:
+            buffer += struct.pack('>BQ', 0xCF, value)
+        elif -0x80 <= value < 0:
+            buffer += struct.pack('>Bb', 0xD0, value)
+        elif -0x8000 <= value < 0:
+            buffer += struct.pack('>Bh', 0xD1, value)
+        elif -0x80000000 <= value < 0:
+            buffer += struct.pack('>Bi', 0xD2, value)
+        elif -0x8000000000000000 <= value < 0:
+            buffer += struct.pack('>Bq', 0xD3, value)
+        else:
+            raise OverflowError("Integer too big: {}".format(value))
+
+    # format, size of the value that follows the type byte
+    _FIXED = {
+        0xCA: ('>f', 4), 0xCB: ('>d', 8),
+        0xCC: ('>B', 1), 0xCD: ('>H', 2), 0xCE: ('>I', 4), 0xCF: ('>Q', 8),
+        0xD0: ('>b', 1), 0xD1: ('>h', 2), 0xD2: ('>i', 4), 0xD3: ('>q', 8),
+    }
+    # type byte -> format of the length of str, bin, array and map
+    _LENGTH = {
+        0xD9: '>B', 0xDA: '>H', 0xDB: '>I',
+        0xC4: '>B', 0xC5: '>H', 0xC6: '>I',
+        0xDC: '>H', 0xDD: '>I',
+        0xDE: '>H', 0xDF: '>I',
+    }
+
+    def _decode(self, data, offset):
+        code = data[offset]
+        offset += 1
+
+        if code < 0x80:
+            return code, offset
+        if code >= 0xE0:
+            return code - 0x100, offset
+        if code == 0xC0:
+            return None, offset
+        if code == 0xC2:
+            return False, offset
+        if code == 0xC3:
+            return True, offset
+
+        if code in self._FIXED:
+            fmt, size = self._FIXED[code]
+            return struct.unpack_from(fmt, data, offset)[0], offset + size
+
+        if 0xA0 <= code <= 0xBF:
+            size = code & 0x1F
+        elif 0x90 <= code <= 0x9F or 0x80 <= code <= 0x8F:
+            size = code & 0x0F
+        elif code in self._LENGTH:
+            fmt = self._LENGTH[code]
+            size = struct.unpack_from(fmt, data, offset)[0]
+            offset += struct.calcsize(fmt)
+        else:
+            raise ValueError("Type not supported: 0x{:02X}".format(code))
+
+        if 0xA0 <= code <= 0xBF or 0xD9 <= code <= 0xDB:
+            if offset + size > len(data):
+                raise IndexError("String out of range")
+            return bytes(data[offset:offset + size]).decode('utf-8'), offset + size
+        if 0xC4 <= code <= 0xC6:
+            if offset + size > len(data):
+                raise IndexError("Binary out of range")
+            return bytes(data[offset:offset + size]), offset + size
+        if 0x90 <= code <= 0x9F or code in (0xDC, 0xDD):
+            items = []
+            for _ in range(size):
+                item, offset = self._decode(data, offset)
+                items.append(item)
+            return items, offset
+
+        obj = {}
+        for _ in range(size):
+            key, offset = self._decode(data, offset)
+            obj[key], offset = self._decode(data, offset)
+        return obj, offset
+
+
+class Schema:
+    # fields is a list of (name, format) or (name, format, scale) where format is a struct
+    # format character ('b', 'B', 'h', 'H', 'i', 'I', 'q', 'Q', 'f', 'd', '?' or '<n>s' for strings).
+    # With a scale the value is sent as round(value * scale) and received as value / scale,
+    # ex. ('temperature', 'h', 100) sends 21.37 as the int16 2137.
+    def __init__(self, schema_id, fields):
+        if not 0 <= schema_id <= 0xFF:
+            raise ValueError("Schema id must be a byte")
+
+        self.schema_id = schema_id
+        self.names = [field[0] for field in fields]
+        self.formats = [field[1] for field in fields]
+        self.scales = [field[2] if len(field) > 2 else None for field in fields]
+        self.struct = struct.Struct('<' + ''.join(self.formats))
+
+        self._name_set = frozenset(self.names)
+
+    def matches(self, obj) -> bool:
+        if isinstance(obj, dict):
+            return obj.keys() == self._name_set
+        if isinstance(obj, (list, tuple)) and len(obj) > 0:
+            return all(isinstance(item, dict) and item.keys() == self._name_set for item in obj)
+        return False
+
+    def pack(self, obj) -> bytes:
+        values = []
+        for name, fmt, scale in zip(self.names, self.formats, self.scales):
+            value = obj[name]
+            if scale is not None:
+                value = round(value * scale)
+            elif fmt.endswith('s') and isinstance(value, str):
+                value = value.encode('utf-8')
+            values.append(value)
+        return self.struct.pack(*values)
+
+    def unpack(self, data) -> dict:
+        obj = {}
+        for name, fmt, scale, value in zip(self.names, self.formats, self.scales, self.struct.unpack(data)):
+            if scale is not None:
+                value = value / scale
+            elif fmt.endswith('s'):
+                value = value.rstrip(b'\x00').decode('utf-8')
+            obj[name] = value
+        return obj
+
+
+class SchemaRegistry:
+    # A dictionary (or a list of dictionaries) with the same keys of a registered schema is
+    # sent as: MARKER SCHEMA schema_id packed_record [packed_record ...]
+    # so the field names never go on air. A frame with more records is received as a list.
+    HEADER_SIZE = 3
+
+    def __init__(self):
+        self._schemas = {}
+
+    def register(self, schema_id, fields) -> Schema:
+        schema = Schema(schema_id, fields)
+        self._schemas[schema_id] = schema
+        return schema
+
+    def unregister(self, schema_id):
+        self._schemas.pop(schema_id, None)
+
+    def find(self, obj) -> Schema or None:
+        for schema in self._schemas.values():
+            if schema.matches(obj):
+                return schema
+        return None
+
+    @staticmethod
+    def is_schema_frame(data) -> bool:
+        return len(data) >= SchemaRegistry.HEADER_SIZE and data[0] == FrameHeader.MARKER and \
+            data[1] == FrameHeader.SCHEMA
+
+    def encode(self, schema, obj) -> bytes:
+        records = obj if isinstance(obj, (list, tuple)) else [obj]
+        return bytes([FrameHeader.MARKER, FrameHeader.SCHEMA, schema.schema_id]) + \
+            b''.join(schema.pack(record) for record in records)
+
+    def decode(self, data):
+        schema = self._schemas.get(data[2])
+        if schema is None:
+            raise ValueError("Schema {} not registered".format(data[2]))
+
+        size = schema.struct.size
+        payload = data[self.HEADER_SIZE:]
+        if len(payload) == 0 or len(payload) % size != 0:
+            raise ValueError("Wrong size for schema {}: {}".format(schema.schema_id, len(payload)))
+
+        records = [schema.unpack(payload[i:i + size]) for i in range(0, len(payload), size)]
+        return records[0] if len(records) == 1 else records
+
+
+class DeflateCompressor:
+    # Compresses a payload with raw deflate and an optional preset dictionary (the same on all the peers):
+    # MARKER DEFLATE compressed_data
+    # The payload is compressed only if it becomes smaller, so a peer without compression
+    # can still read the short messages, and the frames already built by the library are left as they are.
+    HEADER_SIZE = 2
+
+    def __init__(self, dictionary=None, level=9):
+        self.dictionary = dictionary
+        self.level = level
+
+    @staticmethod
+    def is_compressed(data) -> bool:
+        return len(data) >= DeflateCompressor.HEADER_SIZE and data[0] == FrameHeader.MARKER and \
+            data[1] == FrameHeader.DEFLATE
+
+    def compress(self, data) -> bytes:
+        if len(data) <= self.HEADER_SIZE or data[0] == FrameHeader.MARKER:
+            return data
+
+        if self.dictionary is not None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionary)
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+
+        if len(compressed) + self.HEADER_SIZE >= len(data):
+            return data
+        return bytes([FrameHeader.MARKER, FrameHeader.DEFLATE]) + compressed
+
+    def decompress(self, data) -> bytes:
+        if not self.is_compressed(data):
+            return data
+
+        try:
+            if self.dictionary is not None:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.dictionary)
+            else:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return decompressor.decompress(data[self.HEADER_SIZE:]) + decompressor.flush()
+        except zlib.error as e:
+            raise ValueError("Invalid compressed data: {}".format(e))
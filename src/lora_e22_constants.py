@@ -94,6 +94,27 @@ class AirDataRate:
         else:
             return "Invalid Air Data Rate!"
 
+    @staticmethod
+    def get_bps(air_data_rate):
+        if air_data_rate == AirDataRate.AIR_DATA_RATE_000_03:
+            return 300
+        elif air_data_rate == AirDataRate.AIR_DATA_RATE_001_12:
+            return 1200
+        elif air_data_rate == AirDataRate.AIR_DATA_RATE_010_24:
+            return 2400
+        elif air_data_rate == AirDataRate.AIR_DATA_RATE_011_48:
+            return 4800
+        elif air_data_rate == AirDataRate.AIR_DATA_RATE_100_96:
+            return 9600
+        elif air_data_rate == AirDataRate.AIR_DATA_RATE_101_192:
+            return 19200
+        elif air_data_rate == AirDataRate.AIR_DATA_RATE_110_384:
+            return 38400
+        elif air_data_rate == AirDataRate.AIR_DATA_RATE_111_625:
+            return 62500
+        else:
+            raise ValueError("Invalid Air Data Rate!")
+
 
 class SubPacketSetting:
     SPS_240_00 = 0b00
@@ -114,6 +135,19 @@ class SubPacketSetting:
         else:
             return "Invalid Sub Packet Setting!"
 
+    @staticmethod
+    def get_size(sub_packet_setting):
+        if sub_packet_setting == SubPacketSetting.SPS_240_00:
+            return 240
+        elif sub_packet_setting == SubPacketSetting.SPS_128_01:
+            return 128
+        elif sub_packet_setting == SubPacketSetting.SPS_064_10:
+            return 64
+        elif sub_packet_setting == SubPacketSetting.SPS_032_11:
+            return 32
+        else:
+            raise ValueError("Invalid Sub Packet Setting!")
+
 
 class RssiAmbientNoiseEnable:
     RSSI_AMBIENT_NOISE_ENABLED = 0b1
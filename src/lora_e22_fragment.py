@@ -0,0 +1,171 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - fragmentation
+#
+# LoRaE22Fragmenter sends messages bigger than a frame as a sequence of fragments sized on
+# the sub packet setting of the module, and reassembles them on the receiving side.
+# Fragment: MARKER FRAGMENT message_id(2) index count crc(2) payload
+# The message id is random, and the CRC-16 of the whole message separates the messages of
+# different senders with the same id and discards a reassembly gone wrong.
+# Messages that fit in a single frame are sent as they are.
+#############################################################################################
+
+import binascii
+import random
+import struct
+import time
+from collections import OrderedDict
+
+from lora_e22 import BROADCAST_ADDRESS, logger
+from lora_e22_operation_constant import ResponseStatusCode, FrameHeader
+
+FRAGMENT_HEADER_SIZE = 8
+MAX_FRAGMENTS = 255
+
+
+def fragment_crc(message) -> int:
+    return binascii.crc_hqx(message, 0xFFFF)
+
+
+class Reassembler:
+    def __init__(self, max_messages=8, timeout=5000):
+        self.max_messages = max_messages
+        self.timeout = timeout
+
+        self._messages = OrderedDict()
+
+    @staticmethod
+    def is_fragment(data) -> bool:
+        return len(data) >= FRAGMENT_HEADER_SIZE and data[0] == FrameHeader.MARKER and \
+            data[1] == FrameHeader.FRAGMENT
+
+    # Returns the whole message when the last missing fragment arrives, otherwise None
+    def feed(self, data) -> bytes or None:
+        now = time.monotonic()
+        self._expire(now)
+
+        message_id, index, count, crc = struct.unpack_from('>HBBH', data, 2)
+        if count == 0 or index >= count:
+            logger.debug("Invalid fragment {}/{}".format(index, count))
+            return None
+
+        key = (message_id, crc)
+        entry = self._messages.get(key)
+        if entry is None or entry[0] != count:
+            if len(self._messages) >= self.max_messages:
+                evicted, _ = self._messages.popitem(last=False)
+                logger.debug("Reassembly table full, message {} dropped".format(evicted[0]))
+            entry = [count, {}, now]
+            self._messages[key] = entry
+
+        entry[1][index] = bytes(data[FRAGMENT_HEADER_SIZE:])
+        if len(entry[1]) < count:
+            return None
+
+        del self._messages[key]
+        message = b''.join(entry[1][i] for i in range(count))
+        if fragment_crc(message) != crc:
+            logger.debug("Message {} discarded, wrong CRC".format(message_id))
+            return None
+        return message
+
+    def _expire(self, now):
+        while self._messages:
+            key, entry = next(iter(self._messages.items()))
+            if (now - entry[2]) * 1000 < self.timeout:
+                break
+            logger.debug("Message {} expired with {}/{} fragments".format(key[0], len(entry[1]), entry[0]))
+            del self._messages[key]
+
+
+class LoRaE22Fragmenter:
+    def __init__(self, lora, max_messages=8, timeout=5000):
+        self.lora = lora
+        self.reassembler = Reassembler(max_messages, timeout)
+
+        self._message_id = None
+
+    def get_fragment_payload_size(self) -> int:
+        return self.lora.get_max_payload_size() - FRAGMENT_HEADER_SIZE
+
+    def split(self, message) -> list:
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+
+        # Compressed as a whole, the fragments are not compressed again
+        message = self.lora.compress_payload(message)
+        if len(message) <= self.lora.get_max_payload_size():
+            return [message]
+
+        size = self.get_fragment_payload_size()
+        count = (len(message) + size - 1) // size
+        if count > MAX_FRAGMENTS:
+            return None
+
+        # Random, so two senders rarely use the same id at the same time, but never the last one used
+        message_id = random.randrange(0x10000)
+        while message_id == self._message_id:
+            message_id = random.randrange(0x10000)
+        self._message_id = message_id
+        crc = fragment_crc(message)
+
+        return [bytes([FrameHeader.MARKER, FrameHeader.FRAGMENT]) +
+                struct.pack('>HBBH', message_id, index, count, crc) +
+                message[index * size:(index + 1) * size] for index in range(count)]
+
+    def send_transparent_message(self, message) -> ResponseStatusCode:
+        return self._send_message(message)
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        return self._send_message(message, ADDH, ADDL, CHAN)
+
+    def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
+        return self._send_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    def _send_message(self, message, ADDH=None, ADDL=None, CHAN=None) -> ResponseStatusCode:
+        fragments = self.split(message)
+        if fragments is None:
+            return ResponseStatusCode.ERR_E22_PACKET_TOO_BIG
+
+        for fragment in fragments:
+            if ADDH is not None and ADDL is not None and CHAN is not None:
+                code = self.lora.send_fixed_message(ADDH, ADDL, CHAN, fragment)
+            else:
+                code = self.lora.send_transparent_message(fragment)
+
+            if code != ResponseStatusCode.E22_SUCCESS:
+                return code
+
+        return ResponseStatusCode.E22_SUCCESS
+
+    def receive_frame(self, rssi=False, timeout=None) -> (ResponseStatusCode, bytes, int or None):
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = (deadline - time.monotonic()) * 1000
+                if remaining <= 0:
+                    return ResponseStatusCode.ERR_E22_TIMEOUT, None, None
+
+            code, data, rssi_value = self.lora.receive_frame(rssi, timeout=remaining)
+            if code != ResponseStatusCode.E22_SUCCESS:
+                return code, None, None
+
+            if not Reassembler.is_fragment(data):
+                return code, data, rssi_value
+
+            message = self.reassembler.feed(data)
+            if message is not None:
+                try:
+                    return code, self.lora.decompress_payload(message), rssi_value
+                except ValueError as e:
+                    logger.error("Error: {}".format(e))
+                    return ResponseStatusCode.ERR_E22_WRONG_FORMAT, None, None
+
+    def receive_message(self, rssi=False, timeout=None):
+        code, data, rssi_value = self.receive_frame(rssi, timeout)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return (code, None, None) if rssi else (code, None)
+
+        msg = data.decode('utf-8')
+        return (code, msg, rssi_value) if rssi else (code, msg)
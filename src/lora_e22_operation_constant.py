@@ -26,6 +26,18 @@ class RegisterAddress:
     REG_ADDRESS_PID = 0x80
 
 
+# Read of the RSSI registers in normal mode (RSSI ambient noise must be enabled):
+# C0 C1 C2 C3 address length, the module answers C1 address length values
+class RssiCommand:
+    READ_RSSI = (0xC0, 0xC1, 0xC2, 0xC3)
+    RETURNED_COMMAND = 0xC1
+
+
+class RssiAddress:
+    REG_ADDRESS_AMBIENT_NOISE = 0x00
+    REG_ADDRESS_LAST_RSSI = 0x01
+
+
 class PacketLength:
     PL_CONFIGURATION = 0x09
     PL_SPED = 0x01
@@ -36,6 +48,29 @@ class PacketLength:
     PL_PID = 7
 
 
+# Header of the frames built by the library layers (fragmentation, schemas, ...), the marker
+# byte is never valid in UTF-8 text nor at the start of a MessagePack map or array, so it can't
+# be confused with a message, and it's not the first byte of an answer of the module (C1, FF)
+class FrameHeader:
+    MARKER = 0xF5
+    FRAGMENT = 0x01
+    SCHEMA = 0x02
+    DEFLATE = 0x03
+    RELIABLE_DATA = 0x04
+    RELIABLE_ACK = 0x05
+    COALESCED = 0x06
+    RPC_REQUEST = 0x07
+    RPC_RESPONSE = 0x08
+    BEACON = 0x09
+
+
+# Outbound classes of the TransmitScheduler, a lower value is sent first
+class TransmitPriority:
+    CONTROL = 0
+    NORMAL = 1
+    BULK = 2
+
+
 class ResponseStatusCode:
     SUCCESS = 1
     E22_SUCCESS = 1
@@ -55,6 +90,7 @@ class ResponseStatusCode:
     ERR_E22_JSON_PARSE = 15
     ERR_E22_DEINIT_UART_FAILED = 16
     ERR_E22_WRONG_FORMAT = 17
+    ERR_E22_CHANNEL_BUSY = 18
 
     @staticmethod
     def get_description(status):
@@ -92,6 +128,8 @@ class ResponseStatusCode:
             return "Deinit UART failed!"
         elif status == ResponseStatusCode.ERR_E22_WRONG_FORMAT:
             return "Wrong format!"
+        elif status == ResponseStatusCode.ERR_E22_CHANNEL_BUSY:
+            return "Channel busy!"
         else:
             return "Invalid status!"
 
@@ -0,0 +1,167 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - background receiver
+#
+# LoRaE22Receiver drains the UART from a daemon thread, splits the stream in frames
+# and keeps the last frames in a bounded ring buffer, or dispatches them to callbacks.
+# While the receiver is running don't call receive_message/receive_dict of LoRaE22.
+# The RSSI reads (also by listen before talk) pause it, the data received around their
+# answer is passed to the receiver.
+#############################################################################################
+
+import threading
+import time
+from collections import deque
+
+from RPi import GPIO
+
+from lora_e22 import LoRaE22, FrameParser, RX_POLL_INTERVAL, logger
+
+
+class ReceivedFrame:
+    def __init__(self, data, rssi, timestamp):
+        self.data = data
+        self.rssi = rssi
+        self.timestamp = timestamp  # time.monotonic() of the last byte
+
+    def get_rssi_dbm(self) -> int or None:
+        if self.rssi is None:
+            return None
+        return LoRaE22.rssi_to_dbm(self.rssi)
+
+    def decode(self, encoding='utf-8'):
+        return self.data.decode(encoding)
+
+
+class LoRaE22Receiver:
+    # frame_gap is the silence (ms) that closes a frame, by default it's derived from the UART
+    # speed and the air data rate of the module
+    def __init__(self, lora, rssi=False, max_frames=64, frame_gap=None):
+        self.lora = lora
+        self.uart = lora.uart
+        self.rssi = rssi
+        self.frame_gap = frame_gap
+
+        self.dropped = 0
+
+        self._frames = deque(maxlen=max_frames)
+        self._condition = threading.Condition()
+        self._callbacks = []
+        self._thread = None
+        self._running = False
+        self._frame_gap = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        if self.frame_gap is None:
+            self._frame_gap = self.lora.get_frame_idle_gap()
+        else:
+            self._frame_gap = self.frame_gap
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='LoRaE22Receiver', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+    # Callbacks are called from the receiver thread with a ReceivedFrame, they must return quickly.
+    # When at least one callback is registered the frames are not stored in the ring buffer.
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def get(self, timeout=None) -> ReceivedFrame or None:
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+
+        with self._condition:
+            while not self._frames:
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+
+            return self._frames.popleft()
+
+    def available(self) -> int:
+        return len(self._frames)
+
+    def _run(self):
+        parser = FrameParser()
+        last_byte_time = None
+
+        while self._running:
+            try:
+                # Read with the read lock of the module, so the answers to the program mode commands
+                # and to the RSSI reads are read by the exchange that is waiting them and not taken
+                # as received frames. The data the RSSI read has found around its answer is left
+                # in the buffer of the module.
+                with self.lora._rx_lock:
+                    left = self.lora._parser.pop_all()
+                    chunk = left[0] if left is not None else b''
+                    waiting = self.uart.in_waiting
+                    if waiting:
+                        chunk += self.uart.read(waiting)
+            except Exception as e:
+                logger.error("Error: {}".format(e))
+                break
+
+            if chunk:
+                parser.feed(chunk)
+                last_byte_time = time.monotonic()
+
+                if self.lora.length_prefix:
+                    frame = parser.pop_length_prefixed(self.rssi)
+                    while frame is not None:
+                        self._dispatch(frame[0], frame[1], last_byte_time)
+                        frame = parser.pop_length_prefixed(self.rssi)
+                continue
+
+            # A frame is closed by a silence of frame_gap ms, and AUX stays low while the module
+            # outputs the received data
+            if len(parser) == 0 or (time.monotonic() - last_byte_time) * 1000 < self._frame_gap or \
+                    (self.lora.aux_pin is not None and GPIO.input(self.lora.aux_pin) == 0):
+                time.sleep(RX_POLL_INTERVAL)
+                continue
+
+            if self.lora.length_prefix:
+                logger.debug("Incomplete frame discarded: {}".format(bytes(parser.buffer)))
+                parser.clear()
+            else:
+                data, rssi_value = parser.pop_all(self.rssi)
+                self._dispatch(data, rssi_value, last_byte_time)
+
+    def _dispatch(self, data, rssi_value, timestamp):
+        try:
+            data = self.lora.decompress_payload(data)
+        except ValueError as e:
+            logger.error("Error: {}".format(e))
+            return
+
+        received_frame = ReceivedFrame(data, rssi_value, timestamp)
+
+        if self._callbacks:
+            for callback in list(self._callbacks):
+                try:
+                    callback(received_frame)
+                except Exception as e:
+                    logger.error("Error: {}".format(e))
+            return
+
+        with self._condition:
+            if len(self._frames) == self._frames.maxlen:
+                self.dropped += 1
+            self._frames.append(received_frame)
+            self._condition.notify()
@@ -0,0 +1,443 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - reliable transport
+#
+# ReliableTransport adds acknowledged, in order delivery on top of the fixed transmission.
+# Every peer (ADDH, ADDL, CHAN) has a sliding window of sequence numbers: the frames of the
+# window are sent back to back and the last one asks for an ACK, the receiver answers with
+# the next sequence number expected and a bitmap of the frames received after it, so only
+# the missing frames are sent again. The retransmission timeout follows the measured round
+# trip time (RFC 6298, without the samples of the retransmitted frames) and the time on air.
+# Data: MARKER RELIABLE_DATA ADDH ADDL CHAN flags seq base payload
+# Ack:  MARKER RELIABLE_ACK ADDH ADDL CHAN next bitmap(4)
+# The address is the one of the sender, base is its oldest frame not yet acknowledged.
+# The frames are received by a LoRaE22Receiver, the transport registers a callback on it.
+#############################################################################################
+
+import random
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+from lora_e22 import logger
+from lora_e22_operation_constant import ResponseStatusCode, FrameHeader
+
+RELIABLE_DATA_HEADER_SIZE = 8
+RELIABLE_ACK_SIZE = 10
+
+# Limited by the bitmap of the ACK
+MAX_WINDOW = 32
+SEQUENCE_SIZE = 256
+
+FLAG_ACK_REQUEST = 0x01
+# Set until the first ACK of the peer, the receiver restarts from base
+FLAG_SYN = 0x02
+
+# Gains of the round trip time estimators
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+# Added to the first timeout, before a round trip time is measured
+INITIAL_RTO = 1000
+MAX_RTO = 60000
+
+# Longest wait of the thread, it bounds the time needed to stop it
+RELIABLE_WAIT_INTERVAL = 200
+
+
+def seq_distance(seq, start) -> int:
+    return (seq - start) % SEQUENCE_SIZE
+
+
+class OutgoingFrame:
+    def __init__(self, payload):
+        self.payload = payload
+        self.sent = None  # time.monotonic() of the last send
+        self.retransmitted = False
+        self.ack_request = False
+        self.to_send = True
+
+
+class Peer:
+    def __init__(self, rto):
+        # Sender side
+        self.next_seq = random.randrange(SEQUENCE_SIZE)
+        self.unacked = OrderedDict()  # seq -> OutgoingFrame, in order of sequence
+        self.pending = deque()
+        self.synced = False
+        self.srtt = None
+        self.rttvar = None
+        self.rto = rto
+        self.retries = 0
+        self.timer = None
+
+        # Receiver side
+        self.expected = None
+        self.buffered = {}
+        self.ack_due = None
+
+
+class ReliableTransport:
+    # ADDH, ADDL and CHAN are the address of this module, by default from the last configuration read.
+    # ack_delay (ms) is how long the receiver waits more frames before sending an ACK not requested.
+    def __init__(self, lora, receiver, ADDH=None, ADDL=None, CHAN=None, window=8, max_retries=8,
+                 max_pending=64, max_messages=64, ack_delay=None):
+        if not 1 <= window <= MAX_WINDOW:
+            raise ValueError("Window must be between 1 and {}".format(MAX_WINDOW))
+
+        self.lora = lora
+        self.receiver = receiver
+        self.ADDH = ADDH
+        self.ADDL = ADDL
+        self.CHAN = CHAN
+        self.window = window
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.ack_delay = ack_delay
+
+        self.failed = 0
+        self.dropped = 0
+
+        self._peers = {}
+        self._messages = deque(maxlen=max_messages)
+        self._callbacks = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._ack_time = None
+        self._ack_delay = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        configuration = self.lora.configuration
+        if self.ADDH is None:
+            self.ADDH = configuration.ADDH if configuration is not None else 0
+        if self.ADDL is None:
+            self.ADDL = configuration.ADDL if configuration is not None else 0
+        if self.CHAN is None:
+            self.CHAN = self.lora.get_channel()
+
+        self._ack_time = self.lora.get_frame_send_time(RELIABLE_ACK_SIZE + 3)
+        if self.ack_delay is None:
+            self._ack_delay = 2 * self.lora.get_frame_send_time(self.lora.get_max_payload_size() + 3)
+        else:
+            self._ack_delay = self.ack_delay
+
+        self._running = True
+        self.receiver.add_callback(self._on_frame)
+        self._thread = threading.Thread(target=self._run, name='ReliableTransport', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+        self.receiver.remove_callback(self._on_frame)
+
+    def get_max_message_size(self) -> int:
+        return self.lora.get_max_payload_size() - RELIABLE_DATA_HEADER_SIZE
+
+    # Current retransmission timeout (ms) of the peer
+    def get_rto(self, ADDH, ADDL, CHAN) -> float:
+        with self._condition:
+            return self._peer((ADDH, ADDL, CHAN)).rto
+
+    # Queues the message, use flush to wait the ACK of the peers
+    def send_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        if isinstance(message, str):
+            message = message.encode('utf-8')
+
+        message = self.lora.compress_payload(message)
+        if len(message) > self.get_max_message_size():
+            return ResponseStatusCode.ERR_E22_PACKET_TOO_BIG
+
+        with self._condition:
+            peer = self._peer((ADDH, ADDL, CHAN))
+            if len(peer.pending) >= self.max_pending:
+                return ResponseStatusCode.ERR_E22_BUF_TOO_SMALL
+            peer.pending.append(message)
+            self._condition.notify_all()
+
+        return ResponseStatusCode.E22_SUCCESS
+
+    def send_dict(self, ADDH, ADDL, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        return self.send_message(ADDH, ADDL, CHAN, self.lora.encode_dict(dict_message, codec))
+
+    # Waits that all the queued messages are acknowledged, ERR_E22_NO_RESPONSE_FROM_DEVICE
+    # if some of them have been dropped after max_retries timeouts
+    def flush(self, timeout=None) -> ResponseStatusCode:
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+
+        with self._condition:
+            failed = self.failed
+            while any(peer.pending or peer.unacked for peer in self._peers.values()):
+                if deadline is None:
+                    self._condition.wait(RELIABLE_WAIT_INTERVAL / 1000)
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return ResponseStatusCode.ERR_E22_TIMEOUT
+                self._condition.wait(remaining)
+
+            if self.failed != failed:
+                return ResponseStatusCode.ERR_E22_NO_RESPONSE_FROM_DEVICE
+        return ResponseStatusCode.E22_SUCCESS
+
+    # Callbacks are called from the receiver thread with the message and the address of the sender,
+    # when at least one callback is registered the messages are not queued for receive_frame
+    def add_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def receive_frame(self, timeout=None) -> (ResponseStatusCode, bytes, tuple or None):
+        deadline = None if timeout is None else time.monotonic() + timeout / 1000
+
+        with self._condition:
+            while not self._messages:
+                if deadline is None:
+                    self._condition.wait()
+                    continue
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return ResponseStatusCode.ERR_E22_TIMEOUT, None, None
+                self._condition.wait(remaining)
+
+            data, source = self._messages.popleft()
+            return ResponseStatusCode.E22_SUCCESS, data, source
+
+    def receive_message(self, timeout=None) -> (ResponseStatusCode, str, tuple or None):
+        code, data, source = self.receive_frame(timeout)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code, None, None
+        return code, data.decode('utf-8'), source
+
+    def _peer(self, address) -> Peer:
+        peer = self._peers.get(address)
+        if peer is None:
+            peer = Peer(2 * self._ack_time + INITIAL_RTO if self._ack_time is not None else INITIAL_RTO)
+            self._peers[address] = peer
+        return peer
+
+    def _on_frame(self, received_frame):
+        data = received_frame.data
+        if len(data) < 2 or data[0] != FrameHeader.MARKER:
+            return
+
+        if data[1] == FrameHeader.RELIABLE_DATA and len(data) >= RELIABLE_DATA_HEADER_SIZE:
+            delivered = self._on_data(data)
+            for message, source in delivered:
+                self._deliver(message, source)
+        elif data[1] == FrameHeader.RELIABLE_ACK and len(data) >= RELIABLE_ACK_SIZE:
+            self._on_ack(data)
+
+    def _on_data(self, data) -> list:
+        source = (data[2], data[3], data[4])
+        flags, seq, base = data[5], data[6], data[7]
+        now = time.monotonic()
+        delivered = []
+
+        with self._condition:
+            peer = self._peer(source)
+
+            if peer.expected is None or (flags & FLAG_SYN and seq_distance(peer.expected, base) > MAX_WINDOW):
+                peer.expected = base
+                peer.buffered.clear()
+            elif 0 < seq_distance(base, peer.expected) < SEQUENCE_SIZE // 2:
+                # The sender has given up the frames before base
+                logger.debug("Frames {}-{} of {} lost".format(peer.expected, base, source))
+                peer.buffered = {s: p for s, p in peer.buffered.items()
+                                 if seq_distance(s, base) < SEQUENCE_SIZE // 2}
+                peer.expected = base
+
+            duplicate = True
+            if seq_distance(seq, peer.expected) < MAX_WINDOW and seq not in peer.buffered:
+                peer.buffered[seq] = bytes(data[RELIABLE_DATA_HEADER_SIZE:])
+                duplicate = False
+
+            while peer.expected in peer.buffered:
+                delivered.append((peer.buffered.pop(peer.expected), source))
+                peer.expected = (peer.expected + 1) % SEQUENCE_SIZE
+
+            if flags & FLAG_ACK_REQUEST or duplicate:
+                peer.ack_due = now
+            elif peer.ack_due is None:
+                peer.ack_due = now + self._ack_delay / 1000
+            self._condition.notify_all()
+
+        return delivered
+
+    def _on_ack(self, data):
+        source = (data[2], data[3], data[4])
+        next_seq = data[5]
+        bitmap = struct.unpack_from('<I', data, 6)[0]
+        now = time.monotonic()
+
+        with self._condition:
+            peer = self._peer(source)
+            peer.synced = True
+
+            newest_sent = None
+            sample = None
+            for seq in list(peer.unacked):
+                distance = seq_distance(seq, next_seq)
+                if distance < SEQUENCE_SIZE // 2 and not (0 < distance <= MAX_WINDOW and bitmap >> (distance - 1) & 1):
+                    continue
+
+                frame = peer.unacked.pop(seq)
+                if frame.sent is None:
+                    continue
+                if newest_sent is None or frame.sent > newest_sent:
+                    newest_sent = frame.sent
+                    # Karn: a retransmitted frame doesn't tell which send has been acknowledged,
+                    # and an ACK not requested by the frame includes the ack delay
+                    sample = None if frame.retransmitted or not frame.ack_request else (now - frame.sent) * 1000
+
+            if newest_sent is None:
+                return
+
+            peer.retries = 0
+            if sample is not None:
+                self._update_rto(peer, sample)
+
+            # The frames sent before the last one acknowledged are lost
+            for frame in peer.unacked.values():
+                if frame.sent is not None and frame.sent < newest_sent and not frame.to_send:
+                    frame.to_send = True
+                    frame.retransmitted = True
+
+            peer.timer = now + peer.rto / 1000 if peer.unacked else None
+            self._condition.notify_all()
+
+    def _update_rto(self, peer, sample):
+        if peer.srtt is None:
+            peer.srtt = sample
+            peer.rttvar = sample / 2
+        else:
+            peer.rttvar = (1 - RTT_BETA) * peer.rttvar + RTT_BETA * abs(peer.srtt - sample)
+            peer.srtt = (1 - RTT_ALPHA) * peer.srtt + RTT_ALPHA * sample
+        # The variance term is at least the time on air of the ACK
+        peer.rto = min(MAX_RTO, peer.srtt + max(4 * peer.rttvar, self._ack_time))
+
+    def _deliver(self, message, source):
+        try:
+            message = self.lora.decompress_payload(message)
+        except ValueError as e:
+            logger.error("Error: {}".format(e))
+            return
+
+        if self._callbacks:
+            for callback in list(self._callbacks):
+                try:
+                    callback(message, source)
+                except Exception as e:
+                    logger.error("Error: {}".format(e))
+            return
+
+        with self._condition:
+            if len(self._messages) == self._messages.maxlen:
+                self.dropped += 1
+            self._messages.append((message, source))
+            self._condition.notify_all()
+
+    def _ack_frame(self, peer) -> bytes:
+        bitmap = 0
+        for seq in peer.buffered:
+            bitmap |= 1 << (seq_distance(seq, peer.expected) - 1)
+        return bytes([FrameHeader.MARKER, FrameHeader.RELIABLE_ACK, self.ADDH, self.ADDL, self.CHAN,
+                      peer.expected]) + struct.pack('<I', bitmap)
+
+    def _data_frame(self, peer, seq, frame, last) -> bytes:
+        flags = 0 if peer.synced else FLAG_SYN
+        frame.ack_request = last
+        if last:
+            flags |= FLAG_ACK_REQUEST
+        base = next(iter(peer.unacked))
+        return bytes([FrameHeader.MARKER, FrameHeader.RELIABLE_DATA, self.ADDH, self.ADDL, self.CHAN,
+                      flags, seq, base]) + frame.payload
+
+    def _next_frames(self) -> list or None:
+        # (address, peer, OutgoingFrame or None for an ACK, frame) to send
+        while self._running:
+            now = time.monotonic()
+            wait = RELIABLE_WAIT_INTERVAL / 1000
+            frames = []
+
+            for address, peer in self._peers.items():
+                if peer.ack_due is not None:
+                    if peer.ack_due <= now:
+                        frames.append((address, peer, None, self._ack_frame(peer)))
+                        peer.ack_due = None
+                    else:
+                        wait = min(wait, peer.ack_due - now)
+
+                if peer.timer is not None:
+                    if peer.timer <= now:
+                        peer.timer = None
+                        peer.retries += 1
+                        if peer.retries > self.max_retries:
+                            self._give_up(address, peer)
+                            continue
+                        peer.rto = min(MAX_RTO, peer.rto * 2)
+                        for frame in peer.unacked.values():
+                            frame.to_send = True
+                            frame.retransmitted = True
+                    else:
+                        wait = min(wait, peer.timer - now)
+
+                to_send = [(seq, frame) for seq, frame in peer.unacked.items() if frame.to_send]
+                while len(peer.unacked) < self.window and peer.pending:
+                    frame = OutgoingFrame(peer.pending.popleft())
+                    peer.unacked[peer.next_seq] = frame
+                    to_send.append((peer.next_seq, frame))
+                    peer.next_seq = (peer.next_seq + 1) % SEQUENCE_SIZE
+
+                for i, (seq, frame) in enumerate(to_send):
+                    frame.to_send = False
+                    frames.append((address, peer, frame, self._data_frame(peer, seq, frame, i == len(to_send) - 1)))
+
+            if frames:
+                return frames
+            self._condition.wait(max(wait, 0.001))
+        return None
+
+    def _give_up(self, address, peer):
+        lost = len(peer.unacked) + len(peer.pending)
+        self.failed += lost
+        logger.debug("No ACK from {}, {} messages dropped".format(address, lost))
+
+        peer.unacked.clear()
+        peer.pending.clear()
+        peer.synced = False
+        peer.retries = 0
+        peer.rto = 2 * self._ack_time + INITIAL_RTO
+        self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                frames = self._next_frames()
+                if frames is None:
+                    return
+
+            for address, peer, frame, data in frames:
+                code = self.lora.send_fixed_message(address[0], address[1], address[2], data)
+                if code != ResponseStatusCode.E22_SUCCESS:
+                    logger.error("Error: {}".format(ResponseStatusCode.get_description(code)))
+
+                if frame is None:
+                    continue
+                with self._condition:
+                    frame.sent = time.monotonic()
+                    if peer.unacked:
+                        peer.timer = frame.sent + peer.rto / 1000
@@ -0,0 +1,254 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - request/response
+#
+# RpcClient sends requests (dictionaries) to many nodes without waiting the responses one
+# by one: every request has a correlation id, the responses are matched from the receive
+# stream, and each request has its own deadline and retries. RpcServer answers them.
+# Request:  MARKER RPC_REQUEST ADDH ADDL CHAN id(2) request
+# Response: MARKER RPC_RESPONSE ADDH ADDL CHAN id(2) response
+# The address is the one of the sender, the frames are received by a LoRaE22Receiver.
+#############################################################################################
+
+import random
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from lora_e22 import logger
+from lora_e22_operation_constant import ResponseStatusCode, FrameHeader
+
+RPC_HEADER_SIZE = 7
+
+# Longest wait of the thread, it bounds the time needed to stop it
+RPC_WAIT_INTERVAL = 200
+
+
+def rpc_frame(frame_type, address, correlation_id, payload) -> bytes:
+    return bytes([FrameHeader.MARKER, frame_type, address[0], address[1], address[2]]) + \
+        struct.pack('>H', correlation_id) + payload
+
+
+def parse_rpc_frame(data, frame_type) -> (tuple, int, bytes) or None:
+    if len(data) < RPC_HEADER_SIZE or data[0] != FrameHeader.MARKER or data[1] != frame_type:
+        return None
+    return (data[2], data[3], data[4]), struct.unpack_from('>H', data, 5)[0], bytes(data[RPC_HEADER_SIZE:])
+
+
+def own_address(lora, ADDH, ADDL, CHAN) -> tuple:
+    configuration = lora.configuration
+    if ADDH is None:
+        ADDH = configuration.ADDH if configuration is not None else 0
+    if ADDL is None:
+        ADDL = configuration.ADDL if configuration is not None else 0
+    if CHAN is None:
+        CHAN = lora.get_channel()
+    return ADDH, ADDL, CHAN
+
+
+class PendingCall:
+    def __init__(self, address, frame, timeout, retries, future, codec):
+        self.address = address
+        self.frame = frame
+        self.timeout = timeout
+        self.retries = retries
+        self.future = future
+        self.codec = codec  # also used to decode the response
+        self.deadline = None  # set when the request is sent
+
+
+class RpcClient:
+    # ADDH, ADDL and CHAN are the address of this module, by default from the last configuration read
+    def __init__(self, lora, receiver, ADDH=None, ADDL=None, CHAN=None, max_outstanding=256):
+        self.lora = lora
+        self.receiver = receiver
+        self.address = (ADDH, ADDL, CHAN)
+        self.max_outstanding = max_outstanding
+
+        self._calls = {}  # correlation id -> PendingCall
+        self._to_send = deque()
+        self._correlation_id = random.randrange(0x10000)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self.address = own_address(self.lora, *self.address)
+        self._running = True
+        self.receiver.add_callback(self._on_frame)
+        self._thread = threading.Thread(target=self._run, name='RpcClient', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self.receiver.remove_callback(self._on_frame)
+
+        with self._condition:
+            for call in self._calls.values():
+                call.future.set_result((ResponseStatusCode.ERR_E22_TIMEOUT, None))
+            self._calls.clear()
+            self._to_send.clear()
+
+    def outstanding(self) -> int:
+        return len(self._calls)
+
+    # Returns a Future completed with (ResponseStatusCode, response); the request is sent again
+    # up to retries times if the response doesn't arrive within timeout ms from the send
+    def call_async(self, ADDH, ADDL, CHAN, request, timeout=2000, retries=2, codec=None) -> Future:
+        future = Future()
+
+        with self._condition:
+            if len(self._calls) >= self.max_outstanding:
+                future.set_result((ResponseStatusCode.ERR_E22_BUF_TOO_SMALL, None))
+                return future
+
+            correlation_id = self._correlation_id
+            self._correlation_id = (self._correlation_id + 1) % 0x10000
+
+            frame = rpc_frame(FrameHeader.RPC_REQUEST, self.address, correlation_id,
+                              self.lora.encode_dict(request, codec))
+            call = PendingCall((ADDH, ADDL, CHAN), frame, timeout, retries, future, codec)
+            self._calls[correlation_id] = call
+            self._to_send.append(correlation_id)
+            self._condition.notify()
+
+        return future
+
+    def call(self, ADDH, ADDL, CHAN, request, timeout=2000, retries=2, codec=None) -> (ResponseStatusCode, any):
+        return self.call_async(ADDH, ADDL, CHAN, request, timeout, retries, codec).result()
+
+    def _on_frame(self, received_frame):
+        frame = parse_rpc_frame(received_frame.data, FrameHeader.RPC_RESPONSE)
+        if frame is None:
+            return
+
+        address, correlation_id, payload = frame
+        with self._condition:
+            call = self._calls.get(correlation_id)
+            if call is None or call.address != address:
+                # Late response of a request already answered or expired
+                return
+            del self._calls[correlation_id]
+
+        try:
+            response = self.lora.decode_dict(payload, call.codec)
+        except Exception as e:
+            logger.error("Error: {}".format(e))
+            call.future.set_result((ResponseStatusCode.ERR_E22_JSON_PARSE, None))
+            return
+
+        call.future.set_result((ResponseStatusCode.E22_SUCCESS, response))
+
+    def _next_call(self):
+        while self._running:
+            now = time.monotonic()
+            wait = RPC_WAIT_INTERVAL / 1000
+
+            # Expired requests are sent again before the new ones
+            for correlation_id, call in list(self._calls.items()):
+                if call.deadline is None:
+                    continue
+                if call.deadline > now:
+                    wait = min(wait, call.deadline - now)
+                    continue
+
+                call.deadline = None
+                if call.retries > 0:
+                    call.retries -= 1
+                    logger.debug("Request {} sent again".format(correlation_id))
+                    self._to_send.appendleft(correlation_id)
+                else:
+                    del self._calls[correlation_id]
+                    call.future.set_result((ResponseStatusCode.ERR_E22_TIMEOUT, None))
+
+            while self._to_send:
+                correlation_id = self._to_send.popleft()
+                call = self._calls.get(correlation_id)
+                if call is not None:
+                    return correlation_id, call
+
+            self._condition.wait(wait)
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                next_call = self._next_call()
+                if next_call is None:
+                    return
+            correlation_id, call = next_call
+
+            ADDH, ADDL, CHAN = call.address
+            code = self.lora.send_fixed_message(ADDH, ADDL, CHAN, call.frame)
+
+            with self._condition:
+                if correlation_id not in self._calls:
+                    continue
+                if code != ResponseStatusCode.E22_SUCCESS:
+                    del self._calls[correlation_id]
+                    call.future.set_result((code, None))
+                    continue
+                call.deadline = time.monotonic() + call.timeout / 1000
+
+
+class RpcServer:
+    # handler(request, address) returns the response (None to not answer), it's called from the
+    # receiver thread. codec decodes the requests and encodes the responses. The responses are kept
+    # to answer again a retried request without calling the handler.
+    def __init__(self, lora, receiver, handler, ADDH=None, ADDL=None, CHAN=None, codec=None, max_responses=64):
+        self.lora = lora
+        self.receiver = receiver
+        self.handler = handler
+        self.address = (ADDH, ADDL, CHAN)
+        self.codec = codec
+        self.max_responses = max_responses
+
+        self._responses = OrderedDict()  # (address, correlation id) -> response frame
+
+    def start(self):
+        self.address = own_address(self.lora, *self.address)
+        self.receiver.add_callback(self._on_frame)
+
+    def stop(self):
+        self.receiver.remove_callback(self._on_frame)
+
+    def _on_frame(self, received_frame):
+        frame = parse_rpc_frame(received_frame.data, FrameHeader.RPC_REQUEST)
+        if frame is None:
+            return
+
+        address, correlation_id, payload = frame
+        key = (address, correlation_id)
+        response_frame = self._responses.get(key)
+
+        if response_frame is None:
+            try:
+                request = self.lora.decode_dict(payload, self.codec)
+            except Exception as e:
+                logger.error("Error: {}".format(e))
+                return
+
+            response = self.handler(request, address)
+            if response is None:
+                return
+
+            response_frame = rpc_frame(FrameHeader.RPC_RESPONSE, self.address, correlation_id,
+                                       self.lora.encode_dict(response, self.codec))
+            self._responses[key] = response_frame
+            if len(self._responses) > self.max_responses:
+                self._responses.popitem(last=False)
+
+        code = self.lora.send_fixed_message(address[0], address[1], address[2], response_frame)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            logger.error("Error: {}".format(ResponseStatusCode.get_description(code)))
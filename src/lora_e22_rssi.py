@@ -0,0 +1,112 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - RSSI sampler
+#
+# RssiSampler reads the ambient noise and the RSSI of the last packet from a daemon thread
+# every interval ms and keeps the last values, so many readers (listen before talk,
+# schedulers, dashboards) get a recent value without sending a command each.
+# The RSSI read needs RSSI ambient noise enabled and the module in normal mode, a running
+# LoRaE22Receiver is paused while the answer arrives.
+#############################################################################################
+
+import threading
+import time
+
+from lora_e22 import logger
+from lora_e22_operation_constant import ResponseStatusCode, ModeType
+
+
+class RssiSample:
+    def __init__(self, code, value, timestamp):
+        self.code = code
+        self.value = value  # dBm, None if the read failed
+        self.timestamp = timestamp  # time.monotonic() of the read
+
+    def get_age(self) -> float:
+        return (time.monotonic() - self.timestamp) * 1000
+
+
+class RssiSampler:
+    # With last_rssi also the RSSI of the last packet is read at every sample
+    def __init__(self, lora, interval=1000, last_rssi=True):
+        self.lora = lora
+        self.interval = interval
+        self.last_rssi = last_rssi
+
+        self._noise = None
+        self._last_rssi = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        # The listen before talk of the module uses the cached noise
+        self.lora.rssi_sampler = self
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='RssiSampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        if self.lora.rssi_sampler is self:
+            self.lora.rssi_sampler = None
+
+    # Ambient noise (dBm), read again if the cached value is older than max_age ms
+    def get_ambient_noise(self, max_age=None) -> (ResponseStatusCode, int or None):
+        sample = self._noise
+        if sample is None or (max_age is not None and sample.get_age() > max_age):
+            sample = self.sample_ambient_noise()
+        return sample.code, sample.value
+
+    # RSSI (dBm) of the last packet received, read again if the cached value is older than max_age ms
+    def get_last_rssi(self, max_age=None) -> (ResponseStatusCode, int or None):
+        sample = self._last_rssi
+        if sample is None or (max_age is not None and sample.get_age() > max_age):
+            sample = self.sample_last_rssi()
+        return sample.code, sample.value
+
+    def get_ambient_noise_sample(self) -> RssiSample or None:
+        return self._noise
+
+    def get_last_rssi_sample(self) -> RssiSample or None:
+        return self._last_rssi
+
+    # The read is done without the lock of the sampler: a send with listen before talk holds the
+    # lock of the module and then asks the sampler for the noise
+    def sample_ambient_noise(self) -> RssiSample:
+        code, value = self.lora.get_ambient_noise()
+        sample = RssiSample(code, value, time.monotonic())
+        with self._lock:
+            if self._noise is None or self._noise.timestamp < sample.timestamp:
+                self._noise = sample
+        return sample
+
+    def sample_last_rssi(self) -> RssiSample:
+        code, value = self.lora.get_last_rssi()
+        sample = RssiSample(code, value, time.monotonic())
+        with self._lock:
+            if self._last_rssi is None or self._last_rssi.timestamp < sample.timestamp:
+                self._last_rssi = sample
+        return sample
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            # The command is valid only in normal mode, skipped while the module is configured
+            if self.lora.mode != ModeType.MODE_0_NORMAL:
+                self._stop_event.wait(self.interval / 1000)
+                continue
+
+            sample = self.sample_ambient_noise()
+            if sample.code != ResponseStatusCode.E22_SUCCESS:
+                logger.debug("RSSI read: {}".format(ResponseStatusCode.get_description(sample.code)))
+            if self.last_rssi:
+                self.sample_last_rssi()
+
+            self._stop_event.wait(self.interval / 1000)
@@ -0,0 +1,245 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - transmit scheduler
+#
+# TransmitScheduler queues the frames and sends them from a daemon thread, respecting a
+# rolling duty-cycle budget per channel (ex. 1% of every hour in the EU868 sub bands).
+# The time on air of each frame is estimated from the air data rate and the sub packet
+# setting of the module, the budget left can be read to shed load before the limit.
+# The frames are queued by TransmitPriority: at every frame boundary the highest class
+# with a frame ready is served, so control traffic waits at most one frame on air.
+# While the scheduler is running don't send with LoRaE22 directly.
+#############################################################################################
+
+import threading
+import time
+from collections import deque
+
+from lora_e22 import BROADCAST_ADDRESS, logger
+from lora_e22_operation_constant import ResponseStatusCode, TransmitPriority
+
+# Longest wait of the thread, it bounds the time needed to stop it
+SCHEDULER_WAIT_INTERVAL = 200
+
+PRIORITIES = (TransmitPriority.CONTROL, TransmitPriority.NORMAL, TransmitPriority.BULK)
+
+
+class QueuedFrame:
+    def __init__(self, frame, channel, air_time):
+        self.frame = frame
+        self.channel = channel
+        self.air_time = air_time  # ms
+
+
+class TokenBucket:
+    # rate in bytes per second, burst in bytes
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = burst
+        self._last = time.monotonic()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, size, now) -> bool:
+        self._refill(now)
+        # A frame bigger than the burst is sent when the bucket is full
+        size = min(size, self.burst)
+        if self._tokens < size:
+            return False
+        self._tokens -= size
+        return True
+
+    # Time (ms) before size bytes can be consumed
+    def wait_time(self, size, now) -> float:
+        self._refill(now)
+        missing = min(size, self.burst) - self._tokens
+        return max(0, missing * 1000 / self.rate)
+
+
+class TransmitScheduler:
+    # duty_cycle is the fraction of the window (ms) that a channel can be used
+    def __init__(self, lora, duty_cycle=0.01, window=3600000, max_queue=256):
+        self.lora = lora
+        self.duty_cycle = duty_cycle
+        self.window = window
+        self.max_queue = max_queue
+
+        self.dropped = 0
+
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._rate_limits = {}
+        self._usage = {}  # channel -> deque of (time.monotonic() of the send, air time)
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='TransmitScheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+
+    # Limits a class to rate bytes per second, with bursts up to burst bytes (by default one second of rate).
+    # rate None removes the limit.
+    def set_rate_limit(self, priority, rate, burst=None):
+        with self._condition:
+            if rate is None:
+                self._rate_limits.pop(priority, None)
+            else:
+                self._rate_limits[priority] = TokenBucket(rate, burst if burst is not None else rate)
+            self._condition.notify()
+
+    def get_budget(self) -> float:
+        return self.duty_cycle * self.window
+
+    # Air time (ms) still usable on the channel in the current window
+    def get_remaining_budget(self, CHAN=None) -> float:
+        if CHAN is None:
+            CHAN = self.lora.get_channel()
+
+        with self._condition:
+            return self._remaining_budget(CHAN, time.monotonic())
+
+    def pending(self, priority=None) -> int:
+        if priority is not None:
+            return len(self._queues[priority])
+        return sum(len(queue) for queue in self._queues.values())
+
+    def send_transparent_message(self, message, priority=TransmitPriority.NORMAL) -> ResponseStatusCode:
+        return self._queue_message(message, priority)
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message, priority=TransmitPriority.NORMAL) -> ResponseStatusCode:
+        return self._queue_message(message, priority, ADDH, ADDL, CHAN)
+
+    def send_broadcast_message(self, CHAN, message, priority=TransmitPriority.NORMAL) -> ResponseStatusCode:
+        return self._queue_message(message, priority, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    def send_transparent_dict(self, dict_message, codec=None, priority=TransmitPriority.NORMAL) -> ResponseStatusCode:
+        return self._queue_message(self.lora.encode_dict(dict_message, codec), priority)
+
+    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message, codec=None,
+                        priority=TransmitPriority.NORMAL) -> ResponseStatusCode:
+        return self._queue_message(self.lora.encode_dict(dict_message, codec), priority, ADDH, ADDL, CHAN)
+
+    def send_broadcast_dict(self, CHAN, dict_message, codec=None,
+                            priority=TransmitPriority.NORMAL) -> ResponseStatusCode:
+        return self._queue_message(self.lora.encode_dict(dict_message, codec), priority,
+                                   BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    def _queue_message(self, message, priority, ADDH=None, ADDL=None, CHAN=None) -> ResponseStatusCode:
+        if priority not in self._queues:
+            return ResponseStatusCode.ERR_E22_INVALID_PARAM
+
+        code, frame = self.lora.build_frame(message, ADDH, ADDL, CHAN)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code
+
+        if CHAN is None:
+            channel = self.lora.get_channel()
+            payload_size = len(frame)
+        else:
+            # The channel byte selects the frequency, it's not sent
+            channel = CHAN
+            payload_size = len(frame) - 1
+        air_time = self.lora.get_air_time(payload_size)
+
+        if air_time > self.get_budget():
+            logger.debug("Frame of {}ms exceeds the budget".format(air_time))
+            return ResponseStatusCode.ERR_E22_PACKET_TOO_BIG
+
+        with self._condition:
+            if self.pending() >= self.max_queue and not self._drop_lower(priority):
+                return ResponseStatusCode.ERR_E22_BUF_TOO_SMALL
+            self._queues[priority].append(QueuedFrame(frame, channel, air_time))
+            self._condition.notify()
+
+        return ResponseStatusCode.E22_SUCCESS
+
+    # With a full queue a frame takes the place of the newest frame of a lower class
+    def _drop_lower(self, priority) -> bool:
+        for lower in reversed(PRIORITIES):
+            if lower <= priority:
+                return False
+            if self._queues[lower]:
+                self._queues[lower].pop()
+                self.dropped += 1
+                logger.debug("Queue full, frame of class {} dropped".format(lower))
+                return True
+        return False
+
+    def _remaining_budget(self, channel, now) -> float:
+        usage = self._usage.get(channel)
+        if usage is None:
+            return self.get_budget()
+
+        while usage and (now - usage[0][0]) * 1000 >= self.window:
+            usage.popleft()
+        return self.get_budget() - sum(air_time for _, air_time in usage)
+
+    # Time (ms) before enough air time of the channel leaves the window
+    def _budget_wait(self, channel, air_time, now) -> float:
+        missing = air_time - self._remaining_budget(channel, now)
+        for sent, used in self._usage[channel]:
+            missing -= used
+            if missing <= 0:
+                return self.window - (now - sent) * 1000
+        return self.window
+
+    def _next_frame(self):
+        # The first frame of the highest class that is within its rate limit and whose channel has budget
+        while self._running:
+            now = time.monotonic()
+            wait = SCHEDULER_WAIT_INTERVAL
+            for priority in PRIORITIES:
+                queue = self._queues[priority]
+                if not queue:
+                    continue
+
+                bucket = self._rate_limits.get(priority)
+                if bucket is not None:
+                    size = len(queue[0].frame)
+                    bucket_wait = bucket.wait_time(size, now)
+                    if bucket_wait > 0:
+                        wait = min(wait, bucket_wait)
+                        continue
+
+                for queued_frame in queue:
+                    if self._remaining_budget(queued_frame.channel, now) >= queued_frame.air_time:
+                        if bucket is not None and not bucket.consume(len(queued_frame.frame), now):
+                            wait = min(wait, bucket.wait_time(len(queued_frame.frame), now))
+                            break
+                        queue.remove(queued_frame)
+                        return queued_frame
+                    wait = min(wait, self._budget_wait(queued_frame.channel, queued_frame.air_time, now))
+
+            self._condition.wait(max(wait, 1) / 1000)
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                queued_frame = self._next_frame()
+                if queued_frame is None:
+                    return
+                # Charged before the send, so the budget is never exceeded
+                self._usage.setdefault(queued_frame.channel, deque()).append(
+                    (time.monotonic(), queued_frame.air_time))
+
+            code = self.lora.write_frame(queued_frame.frame)
+            if code != ResponseStatusCode.E22_SUCCESS:
+                logger.error("Error: {}".format(ResponseStatusCode.get_description(code)))
@@ -0,0 +1,280 @@
+#############################################################################################
+# EBYTE LoRa E22 Series for RaspberryPi - TDMA
+#
+# TdmaCoordinator divides the time of the channel in superframes: the first slot is used by
+# a broadcast beacon with the time of the coordinator and the slot map, the other slots are
+# assigned to the nodes in order. TdmaNode disciplines its clock on the beacons and sends
+# the queued messages only inside its slot, so the nodes never transmit together.
+# Beacon: MARKER BEACON seq(2) time(4) slot_length(2) count addresses(2 * count)
+# The slot length is the send time of a frame of the maximum size plus a guard time.
+#############################################################################################
+
+import struct
+import threading
+import time
+from collections import deque
+
+from lora_e22 import BROADCAST_ADDRESS, logger
+from lora_e22_operation_constant import ResponseStatusCode, FrameHeader
+
+BEACON_HEADER_SIZE = 11
+
+# Margin (ms) at the end of every slot for the clock errors
+TDMA_GUARD_TIME = 20
+# Without a beacon for these superframes the node stops transmitting
+SYNC_LOST_SUPERFRAMES = 3
+# Gains of the clock discipline on the offset and on the drift
+CLOCK_OFFSET_GAIN = 0.5
+CLOCK_DRIFT_GAIN = 0.1
+CLOCK_WRAP = 0x100000000 / 1000
+
+# Longest wait of the thread, it bounds the time needed to stop it
+TDMA_WAIT_INTERVAL = 200
+
+
+def get_slot_length(lora, guard_time=TDMA_GUARD_TIME) -> int:
+    return int(lora.get_frame_send_time(lora.get_max_payload_size() + 3) + guard_time) + 1
+
+
+class TdmaCoordinator:
+    # nodes is the list of (ADDH, ADDL) of the nodes, one slot each in this order
+    def __init__(self, lora, nodes, slot_length=None, guard_time=TDMA_GUARD_TIME, CHAN=None):
+        if len(nodes) > (lora.get_max_payload_size() - BEACON_HEADER_SIZE) // 2:
+            raise ValueError("Too many nodes for a beacon")
+
+        self.lora = lora
+        self.nodes = list(nodes)
+        self.slot_length = slot_length
+        self.guard_time = guard_time
+        self.CHAN = CHAN
+
+        self._seq = 0
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        if self.slot_length is None:
+            self.slot_length = get_slot_length(self.lora, self.guard_time)
+        if self.CHAN is None:
+            self.CHAN = self.lora.get_channel()
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='TdmaCoordinator', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+    # Superframe length (ms): the beacon slot and a slot for every node
+    def get_superframe_length(self) -> int:
+        return self.slot_length * (len(self.nodes) + 1)
+
+    def build_beacon(self, timestamp) -> bytes:
+        beacon = bytearray([FrameHeader.MARKER, FrameHeader.BEACON])
+        beacon += struct.pack('>HIHB', self._seq, int(timestamp * 1000) & 0xFFFFFFFF, self.slot_length,
+                              len(self.nodes))
+        for ADDH, ADDL in self.nodes:
+            beacon += bytes([ADDH, ADDL])
+        return bytes(beacon)
+
+    def _run(self):
+        start = time.monotonic()
+        while self._running:
+            now = time.monotonic()
+            if now < start:
+                time.sleep(min(start - now, TDMA_WAIT_INTERVAL / 1000))
+                continue
+
+            code = self.lora.send_broadcast_message(self.CHAN, self.build_beacon(start))
+            if code != ResponseStatusCode.E22_SUCCESS:
+                logger.error("Error: {}".format(ResponseStatusCode.get_description(code)))
+            self._seq = (self._seq + 1) % 0x10000
+
+            start += self.get_superframe_length() / 1000
+            if start < time.monotonic():
+                # Late, realigned to the next superframe
+                start = time.monotonic()
+
+
+class TdmaNode:
+    # ADDH and ADDL are the address of this module in the slot map, by default from the last configuration read
+    def __init__(self, lora, receiver, ADDH=None, ADDL=None, guard_time=TDMA_GUARD_TIME, max_queue=64):
+        self.lora = lora
+        self.receiver = receiver
+        self.ADDH = ADDH
+        self.ADDL = ADDL
+        self.guard_time = guard_time
+        self.max_queue = max_queue
+
+        self.slot_length = None
+        self.slot_count = None
+        self.slot_index = None  # None if the node is not in the slot map
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        # Clock of the coordinator = local clock - offset - drift * (local clock - reference)
+        self._offset = None
+        self._drift = 0.0
+        self._reference = None
+        self._superframe_start = None  # on the clock of the coordinator
+        self._last_beacon = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        configuration = self.lora.configuration
+        if self.ADDH is None:
+            self.ADDH = configuration.ADDH if configuration is not None else 0
+        if self.ADDL is None:
+            self.ADDL = configuration.ADDL if configuration is not None else 0
+
+        self._running = True
+        self.receiver.add_callback(self._on_frame)
+        self._thread = threading.Thread(target=self._run, name='TdmaNode', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        self._thread.join()
+        self._thread = None
+        self.receiver.remove_callback(self._on_frame)
+
+    def is_synchronized(self) -> bool:
+        if self._last_beacon is None:
+            return False
+        superframe = self.slot_length * (self.slot_count + 1) / 1000
+        return time.monotonic() - self._last_beacon < SYNC_LOST_SUPERFRAMES * superframe
+
+    # Time (s) of the coordinator clock
+    def get_coordinator_time(self, local=None) -> float or None:
+        if self._offset is None:
+            return None
+        if local is None:
+            local = time.monotonic()
+        return local - self._offset - self._drift * (local - self._reference)
+
+    def pending(self) -> int:
+        return len(self._queue)
+
+    def send_transparent_message(self, message) -> ResponseStatusCode:
+        return self._queue_message(message, None, None, None)
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        return self._queue_message(message, ADDH, ADDL, CHAN)
+
+    def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
+        return self._queue_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+
+    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message, codec=None) -> ResponseStatusCode:
+        return self._queue_message(self.lora.encode_dict(dict_message, codec), ADDH, ADDL, CHAN)
+
+    def _queue_message(self, message, ADDH, ADDL, CHAN) -> ResponseStatusCode:
+        code, frame = self.lora.build_frame(message, ADDH, ADDL, CHAN)
+        if code != ResponseStatusCode.E22_SUCCESS:
+            return code
+
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                return ResponseStatusCode.ERR_E22_BUF_TOO_SMALL
+            self._queue.append(frame)
+            self._condition.notify()
+        return ResponseStatusCode.E22_SUCCESS
+
+    def _on_frame(self, received_frame):
+        data = received_frame.data
+        if len(data) < BEACON_HEADER_SIZE or data[0] != FrameHeader.MARKER or data[1] != FrameHeader.BEACON:
+            return
+
+        seq, timestamp, slot_length, count = struct.unpack_from('>HIHB', data, 2)
+        if len(data) < BEACON_HEADER_SIZE + 2 * count:
+            return
+
+        slot_index = None
+        for i in range(count):
+            if data[BEACON_HEADER_SIZE + 2 * i] == self.ADDH and data[BEACON_HEADER_SIZE + 2 * i + 1] == self.ADDL:
+                slot_index = i
+                break
+
+        # The beacon is stamped when it's written, the last byte arrives after the time to send
+        # it and to output it from the UART of the receiving module
+        delay = self.lora.get_frame_send_time(len(data) + 3) + len(data) * self.lora.get_char_time()
+        local = received_frame.timestamp
+        coordinator = (timestamp + delay) / 1000
+
+        with self._condition:
+            if self._offset is None or self.slot_length != slot_length or self.slot_count != count:
+                self._offset = local - coordinator
+                self._drift = 0.0
+            else:
+                predicted = self.get_coordinator_time(local)
+                # The ms of the coordinator clock are sent on 32 bits, they wrap every 49 days
+                coordinator += round((predicted - coordinator) / CLOCK_WRAP) * CLOCK_WRAP
+                error = predicted - coordinator
+
+                elapsed = local - self._reference
+                if elapsed > 0:
+                    self._drift += CLOCK_DRIFT_GAIN * error / elapsed
+                self._offset = local - (predicted - CLOCK_OFFSET_GAIN * error)
+            self._reference = local
+            self._superframe_start = coordinator - delay / 1000
+            self._last_beacon = local
+
+            self.slot_length = slot_length
+            self.slot_count = count
+            self.slot_index = slot_index
+            self._condition.notify()
+
+    # Local time (s) of the start and of the end of the next slot of the node
+    def _next_slot(self, now) -> (float, float) or None:
+        if self.slot_index is None or not self.is_synchronized():
+            return None
+
+        superframe = self.slot_length * (self.slot_count + 1) / 1000
+        coordinator_now = self.get_coordinator_time(now)
+        slot_start = self._superframe_start + (self.slot_index + 1) * self.slot_length / 1000
+        while slot_start + self.slot_length / 1000 <= coordinator_now:
+            slot_start += superframe
+
+        local_start = now + (slot_start - coordinator_now)
+        return local_start, local_start + self.slot_length / 1000
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+
+                now = time.monotonic()
+                slot = self._next_slot(now) if self._queue else None
+                if slot is None or slot[0] > now:
+                    wait = TDMA_WAIT_INTERVAL / 1000 if slot is None else slot[0] - now
+                    self._condition.wait(min(wait, TDMA_WAIT_INTERVAL / 1000))
+                    continue
+
+                frame = self._queue[0]
+                if now + (self.lora.get_frame_send_time(len(frame)) + self.guard_time) / 1000 > slot[1]:
+                    # Doesn't fit in what is left of the slot, waits the next one
+                    self._condition.wait(min(slot[1] - now + 0.001, TDMA_WAIT_INTERVAL / 1000))
+                    continue
+                self._queue.popleft()
+
+            code = self.lora.write_frame(frame)
+            if code != ResponseStatusCode.E22_SUCCESS:
+                logger.error("Error: {}".format(ResponseStatusCode.get_description(code)))